@@ -2,18 +2,21 @@ from logging_conf import suppress_warnings
 
 suppress_warnings()
 import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import torch
 from torch import no_grad, LongTensor
 import argparse
-import commons
-from mel_processing import spectrogram_torch
+from mel_processing import MelFrontend
 import utils
-from models import SynthesizerTrn
+from utils import language_marks, get_text
+from speaker_delta import SharedBackbone, DeltaModel, load_character_delta, delta_nbytes
 import gradio as gr
 import librosa
 
-from text import text_to_sequence, _clean_text
+from text import enable_cache, initialize as initialize_text
 
 device = "cpu"
 import logging
@@ -30,26 +33,9 @@ logging.getLogger("markdown_it").setLevel(logging.WARNING)
 logging.getLogger("httpx").setLevel(logging.WARNING)
 logging.getLogger("asyncio").setLevel(logging.WARNING)
 
-language_marks = {
-    "Japanese": "",
-    "日本語": "[JA]",
-    "简体中文": "[ZH]",
-    "English": "[EN]",
-    "Mix": "",
-}
 lang = ["日本語", "简体中文", "English", "Mix"]
 
 
-def get_text(text, hps, is_symbol):
-    text_norm = text_to_sequence(
-        text, hps.symbols, [] if is_symbol else hps.data.text_cleaners
-    )
-    if hps.data.add_blank:
-        text_norm = commons.intersperse(text_norm, 0)
-    text_norm = LongTensor(text_norm)
-    return text_norm
-
-
 def create_tts_fn(model, hps, speaker_ids):
     def tts_fn(text, speaker, language, speed, enable_random, seed_value):
         if language is not None:
@@ -81,7 +67,11 @@ def create_tts_fn(model, hps, speaker_ids):
 
 
 def create_vc_fn(model, hps, speaker_ids):
+    frontend = MelFrontend.from_hparams(hps.data).to(device)
+
     def vc_fn(original_speaker, target_speaker, record_audio, upload_audio):
+        if model.enc_q is None:
+            return "This model was exported without enc_q, re-export it with --keep_enc_q true for voice conversion", None
         input_audio = record_audio if record_audio is not None else upload_audio
         if input_audio is None:
             return "You need to record or upload an audio", None
@@ -101,14 +91,7 @@ def create_vc_fn(model, hps, speaker_ids):
             y = y / max(-y.min(), y.max()) / 0.99
             y = y.to(device)
             y = y.unsqueeze(0)
-            spec = spectrogram_torch(
-                y,
-                hps.data.filter_length,
-                hps.data.sampling_rate,
-                hps.data.hop_length,
-                hps.data.win_length,
-                center=False,
-            ).to(device)
+            spec = frontend.spectrogram(y)
             spec_lengths = LongTensor([spec.size(-1)]).to(device)
             sid_src = LongTensor([original_speaker_id]).to(device)
             sid_tgt = LongTensor([target_speaker_id]).to(device)
@@ -126,45 +109,110 @@ def create_vc_fn(model, hps, speaker_ids):
     return vc_fn
 
 
-tts_fn = None
-vc_fn = None
-speakers = None
-
-model_cache = {}
+class ModelCache:
+    """
+    LRU cache of loaded characters, bounded by the bytes of their parameters and buffers.
+    Least recently used characters are evicted once max_bytes is exceeded, the one returned
+    by the latest get() is always kept. Prefetched characters enter at the least recently
+    used end, so a prefetch never pushes out a character that is in use. Loads run on one
+    background thread, so prefetch() never blocks the caller and concurrent requests for the
+    same character share a single load.
+    """
+
+    def __init__(self, loader, max_bytes):
+        self.loader = loader
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # name -> (value, nbytes)
+        self.pending = {}  # name -> Future of an in-flight load
+        self.requested = set()  # names with a get() waiting on their load
+        self.current = None  # name returned by the latest get(), never evicted
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def get(self, name, path):
+        with self.lock:
+            self.current = name
+            if name in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(name)
+                logger.info(f"Loading model {name} from cache ({self.hits} hits, {self.misses} misses)")
+                return self.entries[name][0]
+            self.misses += 1
+            logger.info(f"Cache miss for model {name} ({self.hits} hits, {self.misses} misses)")
+            self.requested.add(name)
+            future = self._submit(name, path)
+        return future.result()
+
+    def prefetch(self, name, path):
+        with self.lock:
+            if name not in self.entries:
+                self._submit(name, path)
+
+    def _submit(self, name, path):
+        # called with self.lock held
+        if name not in self.pending:
+            self.pending[name] = self.executor.submit(self._load, name, path)
+        return self.pending[name]
+
+    def _load(self, name, path):
+        try:
+            value, nbytes = self.loader(path)
+            with self.lock:
+                self.entries[name] = (value, nbytes)
+                if name not in self.requested:
+                    # only prefetched so far, first in line for eviction
+                    self.entries.move_to_end(name, last=False)
+                self._evict()
+            return value
+        finally:
+            with self.lock:
+                self.pending.pop(name, None)
+                self.requested.discard(name)
+
+    def _evict(self):
+        total = sum(nbytes for _, nbytes in self.entries.values())
+        for name in list(self.entries):
+            if total <= self.max_bytes:
+                break
+            if name == self.current:
+                continue
+            _, nbytes = self.entries.pop(name)
+            total -= nbytes
+            logger.info(
+                f"Evicted model {name} ({nbytes / 2 ** 20:.1f} MB), "
+                f"{len(self.entries)} models / {total / 2 ** 20:.1f} MB cached"
+            )
 
 
-def load_model(model_path):
+def _load_model(model_path):
     # get character name by folder name
     character_name = os.path.basename(model_path)
-    if character_name in model_cache:
-        logger.info(f"Loading model {character_name} from cache")
-        return model_cache[character_name]
     logger.info(f"Loading model {character_name} from {model_path}")
-    model_g = os.path.join(model_path, "OUTPUT_MODEL", "G_latest.pth")
-    model_config = os.path.join(model_path, "finetune_speaker.json")
-    hps = utils.get_hparams_from_file(model_config)
-
-    net_g = SynthesizerTrn(
-        len(hps.symbols),
-        hps.data.filter_length // 2 + 1,
-        hps.train.segment_size // hps.data.hop_length,
-        n_speakers=hps.data.n_speakers,
-        **hps.model,
-    ).to(device)
-    _ = net_g.eval()
-
-    _ = utils.load_checkpoint(model_g, net_g, None)
+    if backbone is not None:
+        # only the difference to the shared base model is kept in memory
+        delta, hps = load_character_delta(backbone, model_path)
+        net_g = DeltaModel(backbone, delta)
+        nbytes = delta_nbytes(delta)
+    else:
+        net_g, hps = utils.load_character_model(model_path, device)
+        nbytes = sum(t.numel() * t.element_size() for t in list(net_g.parameters()) + list(net_g.buffers()))
+    # load jieba etc. with the model rather than on its first request
+    initialize_text(hps.data.text_cleaners, getattr(hps.data, "jieba_cache", None))
     speaker_ids = hps.speakers
     speakers = list(hps.speakers.keys())
     tts_fn = create_tts_fn(net_g, hps, speaker_ids)
     vc_fn = create_vc_fn(net_g, hps, speaker_ids)
-    model_cache[character_name] = (tts_fn, vc_fn, speakers)
-    return tts_fn, vc_fn, speakers
+    return (tts_fn, vc_fn, speakers), nbytes
 
 
-def update_model(model_path):
-    global tts_fn, vc_fn, speakers
-    tts_fn, vc_fn, speakers = load_model(model_path)
+model_cache = ModelCache(_load_model, max_bytes=2 * 2 ** 30)
+backbone = None
+
+
+def load_model(model_path):
+    return model_cache.get(os.path.basename(model_path), model_path)
 
 
 if __name__ == "__main__":
@@ -189,15 +237,38 @@ if __name__ == "__main__":
     parser.add_argument(
         "--share", default=False, help="make link public (used in colab)"
     )
+    parser.add_argument(
+        "--cache_mb",
+        type=int,
+        default=2048,
+        help="memory budget of cached models in MB, least recently used ones are evicted",
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=utils.str2bool,
+        default=False,
+        help="load the next model in the list in the background after switching",
+    )
+
+    parser.add_argument(
+        "--base_model",
+        default=None,
+        help="character folder of a shared base model, other characters are then kept as deltas to it",
+    )
 
     args = parser.parse_args()
     model_dir = args.model_dir
+    model_cache.max_bytes = args.cache_mb * 2 ** 20
+    # repeated texts are cleaned once
+    enable_cache()
+    if args.base_model is not None:
+        backbone = SharedBackbone(utils.load_character_model(args.base_model, device)[0])
     characters = os.listdir(model_dir)
     # list all models
     logger.info(f"Available models: {characters}")
     if len(characters) == 0:
         raise Exception("No model found!")
-    update_model(os.path.join(model_dir, characters[0]))
+    _, _, speakers = load_model(os.path.join(model_dir, characters[0]))
     app = gr.Blocks()
     with app:
         with gr.Tab("Text-to-Speech"):
@@ -219,7 +290,11 @@ if __name__ == "__main__":
                     )
 
                     def update_model_dropdown(character):
-                        update_model(os.path.join(model_dir, character))
+                        _, _, speakers = load_model(os.path.join(model_dir, character))
+                        if args.prefetch:
+                            # users tend to browse the list in order
+                            next_character = characters[(characters.index(character) + 1) % len(characters)]
+                            model_cache.prefetch(next_character, os.path.join(model_dir, next_character))
                         return gr.Dropdown(
                             choices=speakers, value=speakers[0], label="说话人 Speaker"
                         )
@@ -249,8 +324,9 @@ if __name__ == "__main__":
                     btn = gr.Button("Generate!")
 
                     def tts_fn_fwd(
-                        text, speaker, language, speed, enable_random, seed_value
+                        character, text, speaker, language, speed, enable_random, seed_value
                     ):
+                        tts_fn, _, _ = load_model(os.path.join(model_dir, character))
                         return tts_fn(
                             text, speaker, language, speed, enable_random, seed_value
                         )
@@ -258,6 +334,7 @@ if __name__ == "__main__":
                     btn.click(
                         tts_fn_fwd,
                         inputs=[
+                            model_dropdown,
                             textbox,
                             char_dropdown,
                             language_dropdown,
@@ -288,14 +365,15 @@ if __name__ == "__main__":
                 converted_audio = gr.Audio(label="converted audio")
             btn = gr.Button("Convert!")
 
-            def vc_fn_fwd(original_speaker, target_speaker, record_audio, upload_audio):
+            def vc_fn_fwd(character, original_speaker, target_speaker, record_audio, upload_audio):
+                _, vc_fn, _ = load_model(os.path.join(model_dir, character))
                 return vc_fn(
                     original_speaker, target_speaker, record_audio, upload_audio
                 )
 
             btn.click(
                 vc_fn_fwd,
-                inputs=[source_speaker, target_speaker, audio],
+                inputs=[model_dropdown, source_speaker, target_speaker, audio],
                 outputs=[message_box, converted_audio],
             )
     app.launch(share=False)
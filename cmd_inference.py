@@ -8,6 +8,10 @@ python cmd_inference.py -m 模型路径 -c 配置文件路径 -o 输出文件路
 -nsw 音素发音长度
 -ls 整体语速
 -on 输出文件的名称
+-tf 批量合成的文本文件，每行输出一个 wav
+-bs 批量合成时每次推理的句数
+--long_text 长文本模式：按标点分句，逐句合成并拼接写入同一个 wav
+--workers 长文本模式下并行清洗文本的线程数
 
 """
 
@@ -17,29 +21,61 @@ from models import SynthesizerTrn
 import torch
 from torch import no_grad, LongTensor
 import librosa
-from text import text_to_sequence, _clean_text
-import commons
+from utils import language_marks, get_text, split_long_text
 import scipy.io.wavfile as wavf
 import os
+import wave
+import numpy as np
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 
 device = "cuda:0" if torch.cuda.is_available() else "cpu"
 
-language_marks = {
-    "Japanese": "",
-    "日本語": "[JA]",
-    "简体中文": "[ZH]",
-    "English": "[EN]",
-    "Mix": "",
-}
-
-
-def get_text(text, hps, is_symbol):
-    text_norm = text_to_sequence(text, hps.symbols, [] if is_symbol else hps.data.text_cleaners)
-    if hps.data.add_blank:
-        text_norm = commons.intersperse(text_norm, 0)
-    text_norm = LongTensor(text_norm)
-    return text_norm
-
+def synthesize_batch(net_g, hps, requests, language=None):
+    """批量合成，一次前向推理处理多条文本
+    requests: [(text, speaker, length_scale, noise_scale, noise_scale_w), ...]
+    返回与 requests 顺序一致的音频列表
+    """
+    marks = language_marks[language] if language is not None else ""
+    stn_tsts = [get_text(marks + r[0] + marks, hps, False).to(device) for r in requests]
+    with no_grad():
+        audios = net_g.infer_batch(
+            stn_tsts,
+            sids=[hps.speakers[r[1]] for r in requests],
+            length_scale=[1.0 / r[2] for r in requests],
+            noise_scale=[r[3] for r in requests],
+            noise_scale_w=[r[4] for r in requests],
+        )
+    return [audio[0].data.cpu().float().numpy() for audio in audios]
+
+
+def synthesize_long_text(net_g, hps, sentences, speaker, output_file, length_scale=1,
+                         noise_scale=.667, noise_scale_w=0.6, workers=2):
+    """逐句合成长文本并增量写入 wav
+    清洗第 N+1 句文本的同时在主线程合成第 N 句，最多提前清洗 workers 句，
+    第一句清洗完即开始合成
+    """
+    sid = LongTensor([hps.speakers[speaker]]).to(device)
+    sentences = iter(sentences)
+    with ThreadPoolExecutor(max_workers=workers) as executor, \
+            wave.open(output_file, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(hps.data.sampling_rate)
+        pending = deque(executor.submit(get_text, s, hps, False) for s in islice(sentences, workers))
+        while pending:
+            stn_tst = pending.popleft().result()
+            for s in islice(sentences, 1):
+                pending.append(executor.submit(get_text, s, hps, False))
+            with no_grad():
+                x_tst = stn_tst.unsqueeze(0).to(device)
+                x_tst_lengths = LongTensor([stn_tst.size(0)]).to(device)
+                audio = net_g.infer(x_tst, x_tst_lengths, sid=sid, noise_scale=noise_scale,
+                                    noise_scale_w=noise_scale_w,
+                                    length_scale=length_scale)[0][0, 0].data.cpu().float().numpy()
+            audio = np.clip(audio * 32767, -32768, 32767).astype(np.int16)
+            wav_file.writeframes(audio.tobytes())
 
 
 if __name__ == "__main__":
@@ -58,6 +94,10 @@ if __name__ == "__main__":
     parser.add_argument('-ns', '--noise_scale', type=float,default= .667,help='感情变化程度')
     parser.add_argument('-nsw', '--noise_scale_w', type=float,default=0.6, help='音素发音长度')
     parser.add_argument('-ls', '--length_scale', type=float,default=1, help='整体语速')
+    parser.add_argument('-tf', '--text_file', type=str, help='批量合成的文本文件，每行一句')
+    parser.add_argument('-bs', '--batch_size', type=int, default=8, help='批量合成时每次推理的句数')
+    parser.add_argument('--long_text', action='store_true', help='长文本模式，分句合成并拼接为一个 wav')
+    parser.add_argument('--workers', type=int, default=2, help='长文本模式下并行清洗文本的线程数')
     
     args = parser.parse_args()
     
@@ -83,11 +123,29 @@ if __name__ == "__main__":
         **hps.model).to(device)
     _ = net_g.eval()
     _ = utils.load_checkpoint(model_path, net_g, None)
+    net_g.prepare_for_inference()
     
     speaker_ids = hps.speakers
 
 
-    if language is not None:
+    if args.long_text:
+        if args.text_file is not None:
+            with open(args.text_file, "r", encoding="utf-8") as f:
+                text = "\n".join(line.strip() for line in f if line.strip())
+        sentences = [s for line in text.split("\n") for s in split_long_text(line, language)]
+        synthesize_long_text(net_g, hps, sentences, spk, str(output_dir)+"/"+output_name+".wav",
+                             length_scale=1.0 / length, noise_scale=noise_scale,
+                             noise_scale_w=noise_scale_w, workers=args.workers)
+    elif args.text_file is not None:
+        with open(args.text_file, "r", encoding="utf-8") as f:
+            lines = [line.strip() for line in f if line.strip()]
+        for start in range(0, len(lines), args.batch_size):
+            requests = [(line, spk, length, noise_scale, noise_scale_w)
+                        for line in lines[start:start + args.batch_size]]
+            audios = synthesize_batch(net_g, hps, requests, language)
+            for i, audio in enumerate(audios):
+                wavf.write(str(output_dir)+"/"+output_name+"_"+str(start + i)+".wav",hps.data.sampling_rate,audio)
+    elif language is not None:
         text = language_marks[language] + text + language_marks[language]
         speaker_id = speaker_ids[spk]
         stn_tst = get_text(text, hps, False)
@@ -0,0 +1,41 @@
+"""Convert a .pth generator checkpoint to safetensors for memory-mapped loading
+
+python convert_checkpoint.py -m ./OUTPUT_MODEL/G_latest.pth -o ./OUTPUT_MODEL/G_latest.safetensors
+
+Only the model weights, iteration and learning rate are kept, the optimizer state is dropped,
+so convert inference checkpoints rather than ones training should resume from.
+utils.load_checkpoint picks the format from the .safetensors extension.
+Requires `pip install safetensors`.
+"""
+import argparse
+import os
+
+import utils
+
+
+def convert_checkpoint(checkpoint_path, output_path):
+    from safetensors.torch import save_file
+
+    checkpoint_dict = utils.torch_load_mmap(checkpoint_path)
+    # safetensors refuses shared or non-contiguous storage
+    state_dict = {k: v.contiguous().clone() for k, v in checkpoint_dict["model"].items()}
+    save_file(
+        state_dict,
+        output_path,
+        metadata={
+            "iteration": str(checkpoint_dict["iteration"]),
+            "learning_rate": str(checkpoint_dict["learning_rate"]),
+        },
+    )
+    return os.path.getsize(checkpoint_path), os.path.getsize(output_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--model", type=str, required=True, help=".pth checkpoint")
+    parser.add_argument("-o", "--output", type=str, default=None, help="defaults to the checkpoint path with .safetensors")
+    args = parser.parse_args()
+
+    output = args.output if args.output is not None else os.path.splitext(args.model)[0] + ".safetensors"
+    before, after = convert_checkpoint(args.model, output)
+    print(f"converted {args.model} -> {output}: {before / 2 ** 20:.1f} MB -> {after / 2 ** 20:.1f} MB")
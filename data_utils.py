@@ -1,17 +1,32 @@
 import time
 import os
+import json
 import random
+import shutil
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import torch
 import torch.utils.data
+import soundfile
 import torchaudio
+from torch.nn.utils.rnn import pad_sequence
 
 import commons
-from mel_processing import spectrogram_torch
+from mel_processing import MelFrontend, set_range_check
 from utils import load_wav_to_torch, load_filepaths_and_text
-from text import text_to_sequence, cleaned_text_to_sequence
+from text import text_to_sequence, cleaned_text_to_sequence, enable_cache, initialize as initialize_text
 """Multi speaker version"""
 
+logger = logging.getLogger(__name__)
+
+def clear_spec_cache(cache_dir):
+    """Remove every cached spectrogram so they are recomputed on next access"""
+    if cache_dir is not None and os.path.isdir(cache_dir):
+        logger.info(f"Removing spectrogram cache {cache_dir}")
+        shutil.rmtree(cache_dir)
+
 
 class TextAudioSpeakerLoader(torch.utils.data.Dataset):
     """
@@ -21,7 +36,8 @@ class TextAudioSpeakerLoader(torch.utils.data.Dataset):
     """
 
     def __init__(self, audiopaths_sid_text, hparams, symbols):
-        self.audiopaths_sid_text = load_filepaths_and_text(audiopaths_sid_text)
+        self.filelist = audiopaths_sid_text
+        self.audiopaths_sid_text = self._load_entries(audiopaths_sid_text)
         self.text_cleaners = hparams.text_cleaners
         self.max_wav_value = hparams.max_wav_value
         self.sampling_rate = hparams.sampling_rate
@@ -29,8 +45,17 @@ class TextAudioSpeakerLoader(torch.utils.data.Dataset):
         self.hop_length = hparams.hop_length
         self.win_length = hparams.win_length
         self.sampling_rate = hparams.sampling_rate
+        self.frontend = MelFrontend.from_hparams(hparams)
 
         self.cleaned_text = getattr(hparams, "cleaned_text", False)
+        # prebuilt jieba dictionary cache, see text.mandarin.initialize
+        self.jieba_cache = getattr(hparams, "jieba_cache", None)
+        # sqlite file of cleaned texts shared by all workers, see text.cache
+        self.cleaner_cache = getattr(hparams, "cleaner_cache", None)
+        self.range_check = getattr(hparams, "range_check", "count")
+        # off unless spec_cache_dir is set in the config, linear spectrograms take more disk than the wavs
+        self.spec_cache_dir = getattr(hparams, "spec_cache_dir", None)
+        self.spec_cache_fp16 = getattr(hparams, "spec_cache_fp16", False)
 
         self.add_blank = hparams.add_blank
         self.min_text_len = getattr(hparams, "min_text_len", 1)
@@ -41,25 +66,76 @@ class TextAudioSpeakerLoader(torch.utils.data.Dataset):
         random.shuffle(self.audiopaths_sid_text)
         self._filter()
 
+    def _load_entries(self, audiopaths_sid_text):
+        return load_filepaths_and_text(audiopaths_sid_text)
+
     def _filter(self):
         """
         Filter text & store spec lengths
         """
         # Store spectrogram lengths for Bucketing
-        # wav_length ~= file_size / (wav_channels * Bytes per dim) = file_size / (1 * 2)
+        # wav_length is read from the file header
         # spec_length = wav_length // hop_length
 
         audiopaths_sid_text_new = []
         lengths = []
-        for audiopath, sid, text in self.audiopaths_sid_text:
-            # audiopath = "./user_voice/" + audiopath
-
-            if self.min_text_len <= len(text) and len(text) <= self.max_text_len:
-                audiopaths_sid_text_new.append([audiopath, sid, text])
-                lengths.append(os.path.getsize(audiopath) // (2 * self.hop_length))
+        mismatched = []
+        candidates = [
+            [audiopath, sid, text] for audiopath, sid, text in self.audiopaths_sid_text
+            if self.min_text_len <= len(text) and len(text) <= self.max_text_len
+        ]
+        audio_infos = self._load_audio_infos([audiopath for audiopath, _, _ in candidates])
+        for audiopath, sid, text in candidates:
+            num_frames, sampling_rate = audio_infos[audiopath]
+            if sampling_rate != self.sampling_rate:
+                mismatched.append(audiopath)
+                continue
+            audiopaths_sid_text_new.append([audiopath, sid, text])
+            lengths.append(num_frames // self.hop_length)
+        if len(mismatched) > 0:
+            logger.warning("Skipped {} files whose sampling rate is not {}, e.g. {}".format(
+                len(mismatched), self.sampling_rate, mismatched[:5]))
         self.audiopaths_sid_text = audiopaths_sid_text_new
         self.lengths = lengths
 
+    def _load_audio_infos(self, audiopaths):
+        """
+        (num_frames, sampling_rate) of every file, read from the wav headers in parallel.
+        Results are kept in a sidecar <filelist>.lengths.json and only re-read for
+        files whose size or mtime changed.
+        """
+        index_path = self.filelist + ".lengths.json"
+        index = {}
+        if os.path.exists(index_path):
+            try:
+                with open(index_path, "r", encoding="utf-8") as f:
+                    index = json.load(f)
+            except ValueError:
+                logger.warning(f"Ignoring broken length index {index_path}")
+
+        def stat_key(audiopath):
+            stat = os.stat(audiopath)
+            return [stat.st_mtime_ns, stat.st_size]
+
+        def read_info(audiopath):
+            # header only, torchaudio.info is gone from newer torchaudio releases
+            info = soundfile.info(audiopath)
+            return stat_key(audiopath) + [info.frames, info.samplerate]
+
+        stale = [
+            audiopath for audiopath in set(audiopaths)
+            if audiopath not in index or index[audiopath][:2] != stat_key(audiopath)
+        ]
+        if len(stale) > 0:
+            with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) + 4)) as executor:
+                for audiopath, info in zip(stale, executor.map(read_info, stale)):
+                    index[audiopath] = info
+            tmp_path = f"{index_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(index, f, ensure_ascii=False)
+            os.replace(tmp_path, index_path)
+        return {audiopath: tuple(index[audiopath][2:]) for audiopath in audiopaths}
+
     def get_audio_text_speaker_pair(self, audiopath_sid_text):
         # separate filename, speaker_id and text
         audiopath, sid, text = audiopath_sid_text[0], audiopath_sid_text[1], audiopath_sid_text[2]
@@ -76,31 +152,62 @@ class TextAudioSpeakerLoader(torch.utils.data.Dataset):
         # audio_norm = audio / self.max_wav_value if audio.max() > 10 else audio
         # audio_norm = audio_norm.unsqueeze(0)
         audio_norm, sampling_rate = torchaudio.load(filename, frame_offset=0, num_frames=-1, normalize=True, channels_first=True)
-        # spec_filename = filename.replace(".wav", ".spec.pt")
-        # if os.path.exists(spec_filename):
-        #     spec = torch.load(spec_filename)
-        # else:
-        #     try:
-        spec = spectrogram_torch(audio_norm, self.filter_length,
-                                 self.sampling_rate, self.hop_length, self.win_length,
-                                 center=False)
-        spec = spec.squeeze(0)
-            # except NotImplementedError:
-            #     print("?")
-            # spec = torch.squeeze(spec, 0)
-            # torch.save(spec, spec_filename)
+        spec = self.load_cached_spec(filename)
+        if spec is None:
+            spec = self.frontend.spectrogram(audio_norm)
+            spec = spec.squeeze(0)
+            self.save_cached_spec(filename, spec)
         return spec, audio_norm
 
+    def spec_cache_path(self, filename):
+        """Cache entries are keyed by the audio path, its mtime/size and the STFT parameters"""
+        stat = os.stat(filename)
+        key = "|".join(str(v) for v in (
+            os.path.abspath(filename), stat.st_mtime_ns, stat.st_size,
+            self.filter_length, self.sampling_rate, self.hop_length, self.win_length))
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.spec_cache_dir, digest[:2], digest + ".spec.pt")
+
+    def load_cached_spec(self, filename):
+        if self.spec_cache_dir is None:
+            return None
+        spec_filename = self.spec_cache_path(filename)
+        if not os.path.exists(spec_filename):
+            return None
+        try:
+            return torch.load(spec_filename).float()
+        except Exception as e:
+            logger.warning(f"Ignoring broken spectrogram cache {spec_filename}: {e}")
+            return None
+
+    def save_cached_spec(self, filename, spec):
+        if self.spec_cache_dir is None:
+            return
+        spec_filename = self.spec_cache_path(filename)
+        os.makedirs(os.path.dirname(spec_filename), exist_ok=True)
+        # write to a private file first so concurrent workers never read a partial entry
+        tmp_filename = f"{spec_filename}.{os.getpid()}.tmp"
+        torch.save(spec.half() if self.spec_cache_fp16 else spec, tmp_filename)
+        os.replace(tmp_filename, spec_filename)
+
     def get_text(self, text):
         if self.cleaned_text:
             text_norm = cleaned_text_to_sequence(text, self.symbols)
         else:
-            text_norm = text_to_sequence(text, self.text_cleaners)
+            text_norm = text_to_sequence(text, self.symbols, self.text_cleaners)
         if self.add_blank:
             text_norm = commons.intersperse(text_norm, 0)
         text_norm = torch.LongTensor(text_norm)
         return text_norm
 
+    def warm_up(self):
+        """Load the text frontend before the first sample instead of on it"""
+        if not self.cleaned_text:
+            initialize_text(self.text_cleaners, self.jieba_cache)
+            # without the cache every text is cleaned again each epoch. finetune_speaker_v2 puts
+            # the sqlite store in the model dir, so all workers share it.
+            enable_cache(self.cleaner_cache)
+
     def get_sid(self, sid):
         sid = torch.LongTensor([int(sid)])
         return sid
@@ -112,12 +219,82 @@ class TextAudioSpeakerLoader(torch.utils.data.Dataset):
         return len(self.audiopaths_sid_text)
 
 
+class PackedTextAudioSpeakerLoader(TextAudioSpeakerLoader):
+    """
+        Same samples as TextAudioSpeakerLoader, but audio and spectrograms are read
+        from the contiguous blobs written by pack_dataset.py through numpy.memmap,
+        so a step touches two files instead of one wav per sample and the page
+        cache is shared between DDP ranks and DataLoader workers.
+        The first field of each entry is the row of the sample in the pack index.
+    """
+
+    def __init__(self, packed_dir, hparams, symbols):
+        self.packed_dir = packed_dir
+        with open(os.path.join(packed_dir, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.index = np.load(os.path.join(packed_dir, "index.npy"))
+        self._audio = None
+        self._spec = None
+        super().__init__(packed_dir, hparams, symbols)
+
+    def _load_entries(self, packed_dir):
+        return [[str(i), sid, text] for i, (_, sid, text) in enumerate(self.meta["entries"])]
+
+    def _filter(self):
+        for key in ["sampling_rate", "filter_length", "hop_length", "win_length"]:
+            if self.meta[key] != getattr(self, key):
+                raise ValueError("{} was packed with {}={}, but the config uses {}".format(
+                    self.packed_dir, key, self.meta[key], getattr(self, key)))
+        audiopaths_sid_text_new = []
+        lengths = []
+        for idx, sid, text in self.audiopaths_sid_text:
+            if self.min_text_len <= len(text) and len(text) <= self.max_text_len:
+                audiopaths_sid_text_new.append([idx, sid, text])
+                lengths.append(int(self.index[int(idx), 3]))
+        self.audiopaths_sid_text = audiopaths_sid_text_new
+        self.lengths = lengths
+
+    def _open(self):
+        # opened lazily so every worker process maps the files itself
+        if self._audio is None:
+            self._audio = np.memmap(os.path.join(self.packed_dir, "audio.bin"), dtype=np.int16, mode="c")
+            self._spec = np.memmap(os.path.join(self.packed_dir, "spec.bin"), dtype=self.meta["spec_dtype"],
+                                   mode="c").reshape(-1, self.meta["n_freq"])
+
+    def get_audio(self, filename):
+        self._open()
+        wav_offset, wav_len, spec_offset, spec_len = self.index[int(filename)]
+        audio_norm = torch.from_numpy(self._audio[wav_offset:wav_offset + wav_len]).float() / 32768.0
+        # spec.bin is frame-major, so the transposed view is [n_freq, frames] without a copy
+        spec = torch.from_numpy(self._spec[spec_offset:spec_offset + spec_len]).transpose(0, 1)
+        return spec.float(), audio_norm.unsqueeze(0)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_audio"] = None
+        state["_spec"] = None
+        return state
+
+
+def worker_init_fn(worker_id):
+    """DataLoader worker_init_fn, warms up the text frontend of every worker process"""
+    dataset = torch.utils.data.get_worker_info().dataset
+    # counts made in a worker would never be reported, the training process counts the
+    # waveforms of each batch instead. Clamping has to happen here, before the spectrogram.
+    set_range_check("clamp" if dataset.range_check == "clamp" else "off")
+    dataset.warm_up()
+
+
 class TextAudioSpeakerCollate():
     """ Zero-pads model inputs and targets
     """
 
-    def __init__(self, return_ids=False):
+    def __init__(self, return_ids=False, pin_memory=False):
         self.return_ids = return_ids
+        # pin the padded batch in collate, DataLoader(pin_memory=True) then leaves it as is.
+        # Only usable with num_workers=0, since worker processes cannot pin memory once CUDA
+        # is initialized in the parent.
+        self.pin_memory = pin_memory
 
     def __call__(self, batch):
         """Collate's training batch from normalized text, audio and speaker identities
@@ -129,43 +306,36 @@ class TextAudioSpeakerCollate():
         _, ids_sorted_decreasing = torch.sort(
             torch.LongTensor([x[1].size(1) for x in batch]),
             dim=0, descending=True)
+        rows = [batch[i] for i in ids_sorted_decreasing.tolist()]
 
-        max_text_len = max([len(x[0]) for x in batch])
-        max_spec_len = max([x[1].size(1) for x in batch])
-        max_wav_len = max([x[2].size(1) for x in batch])
-
-        text_lengths = torch.LongTensor(len(batch))
-        spec_lengths = torch.LongTensor(len(batch))
-        wav_lengths = torch.LongTensor(len(batch))
-        sid = torch.LongTensor(len(batch))
-
-        text_padded = torch.LongTensor(len(batch), max_text_len)
-        spec_padded = torch.FloatTensor(len(batch), batch[0][1].size(0), max_spec_len)
-        wav_padded = torch.FloatTensor(len(batch), 1, max_wav_len)
-        text_padded.zero_()
-        spec_padded.zero_()
-        wav_padded.zero_()
-        for i in range(len(ids_sorted_decreasing)):
-            row = batch[ids_sorted_decreasing[i]]
+        texts = [row[0] for row in rows]
+        specs = [row[1] for row in rows]
+        wavs = [row[2] for row in rows]
 
-            text = row[0]
-            text_padded[i, :text.size(0)] = text
-            text_lengths[i] = text.size(0)
+        text_lengths = torch.LongTensor([text.size(0) for text in texts])
+        spec_lengths = torch.LongTensor([spec.size(1) for spec in specs])
+        wav_lengths = torch.LongTensor([wav.size(1) for wav in wavs])
+        sid = torch.cat([row[3] for row in rows])
 
-            spec = row[1]
-            spec_padded[i, :, :spec.size(1)] = spec
-            spec_lengths[i] = spec.size(1)
-
-            wav = row[2]
-            wav_padded[i, :, :wav.size(1)] = wav
-            wav_lengths[i] = wav.size(1)
-
-            sid[i] = row[3]
+        text_padded = pad_sequence(texts, batch_first=True)
+        spec_padded = self._pad(specs)
+        wav_padded = self._pad(wavs)
+        if self.pin_memory:
+            text_padded = text_padded.pin_memory()
+            spec_padded = spec_padded.pin_memory()
+            wav_padded = wav_padded.pin_memory()
 
         if self.return_ids:
             return text_padded, text_lengths, spec_padded, spec_lengths, wav_padded, wav_lengths, sid, ids_sorted_decreasing
         return text_padded, text_lengths, spec_padded, spec_lengths, wav_padded, wav_lengths, sid
 
+    @staticmethod
+    def _pad(tensors):
+        """Zero-pad [c, t_i] tensors into a contiguous float [b, c, max(t_i)] with one pad_sequence call"""
+        padded = pad_sequence([x.transpose(0, 1) for x in tensors], batch_first=True)  # [b, max(t_i), c]
+        # transpose only swaps strides, contiguous() does the copy into [b, c, max(t_i)] layout
+        return padded.transpose(1, 2).float().contiguous()
+
 
 class DistributedBucketSampler(torch.utils.data.distributed.DistributedSampler):
     """
@@ -245,8 +415,9 @@ class DistributedBucketSampler(torch.utils.data.distributed.DistributedSampler):
             ids_bucket = ids_bucket[self.rank::self.num_replicas]
 
             # batching
-            for j in range(len(ids_bucket) // self.batch_size):
-                batch = [bucket[idx] for idx in ids_bucket[j * self.batch_size:(j + 1) * self.batch_size]]
+            batch_size = self._bucket_batch_size(i)
+            for j in range(len(ids_bucket) // batch_size):
+                batch = [bucket[idx] for idx in ids_bucket[j * batch_size:(j + 1) * batch_size]]
                 batches.append(batch)
 
         if self.shuffle:
@@ -254,9 +425,12 @@ class DistributedBucketSampler(torch.utils.data.distributed.DistributedSampler):
             batches = [batches[i] for i in batch_ids]
         self.batches = batches
 
-        assert len(self.batches) * self.batch_size == self.num_samples
+        assert sum(len(batch) for batch in self.batches) == self.num_samples
         return iter(self.batches)
 
+    def _bucket_batch_size(self, idx_bucket):
+        return self.batch_size
+
     def _bisect(self, x, lo=0, hi=None):
         if hi is None:
             hi = len(self.boundaries) - 1
@@ -274,3 +448,58 @@ class DistributedBucketSampler(torch.utils.data.distributed.DistributedSampler):
 
     def __len__(self):
         return self.num_samples // self.batch_size
+
+
+class DistributedTokenBucketSampler(DistributedBucketSampler):
+    """
+    Same bucketing as DistributedBucketSampler, but batches are sized by a budget of
+    padded spectrogram frames instead of a fixed number of samples.
+    Every bucket gets batch_size = max_frames // upper boundary of the bucket, so short
+    clips are packed into large batches and long clips into small ones.
+    For a given epoch every rank takes the same number of steps, and at each step all ranks
+    draw a batch of the same size from the same bucket, so padded lengths are bounded by the
+    same boundary. The samples themselves, and so the exact padded lengths, differ between ranks.
+    """
+
+    def __init__(self, dataset, max_frames, boundaries, num_replicas=None, rank=None, shuffle=True):
+        self.max_frames = max_frames
+        super().__init__(dataset, 1, boundaries, num_replicas=num_replicas, rank=rank, shuffle=shuffle)
+
+    def _create_buckets(self):
+        buckets, _ = super()._create_buckets()
+        self.batch_sizes = [max(1, self.max_frames // self.boundaries[i + 1]) for i in range(len(buckets))]
+
+        num_samples_per_bucket = []
+        for i in range(len(buckets)):
+            len_bucket = len(buckets[i])
+            total_batch_size = self.num_replicas * self.batch_sizes[i]
+            rem = (total_batch_size - (len_bucket % total_batch_size)) % total_batch_size
+            num_samples_per_bucket.append(len_bucket + rem)
+        return buckets, num_samples_per_bucket
+
+    def _bucket_batch_size(self, idx_bucket):
+        return self.batch_sizes[idx_bucket]
+
+    def __iter__(self):
+        batches = super().__iter__()
+        self.padding_efficiency = self.compute_padding_efficiency(self.batches)
+        if self.rank == 0:
+            logger.info("Token bucket sampler: {} batches, batch sizes {}, padding efficiency {:.1%}".format(
+                len(self.batches), self.batch_sizes, self.padding_efficiency))
+        return batches
+
+    def compute_padding_efficiency(self, batches):
+        """Fraction of spectrogram frames in the padded batches that are real data"""
+        real = 0
+        padded = 0
+        for batch in batches:
+            batch_lengths = [self.lengths[idx] for idx in batch]
+            real += sum(batch_lengths)
+            padded += len(batch_lengths) * max(batch_lengths)
+        return real / max(padded, 1)
+
+    def __len__(self):
+        return sum(
+            self.num_samples_per_bucket[i] // self.num_replicas // self.batch_sizes[i]
+            for i in range(len(self.buckets))
+        )
@@ -0,0 +1,62 @@
+"""Export a fine-tuned generator checkpoint as a compact inference-only artifact
+
+python export_model.py -c ./configs/modified_finetune_speaker.json -m ./OUTPUT_MODEL/G_latest.pth -o ./OUTPUT_MODEL/G_infer.pth
+
+The artifact holds the weight-norm folded state dict of enc_p, dp, flow, dec, emb_g and
+enc_q, optionally cast to fp16/bf16, and the config including the speaker map. enc_q is only
+needed for voice conversion, --keep_enc_q false drops it for a smaller TTS-only artifact. No optimizer state, no discriminator.
+Load it with utils.load_inference_model, no training config needed.
+"""
+import os
+import json
+import argparse
+import torch
+
+import utils
+from models import SynthesizerTrn
+
+DTYPES = {"fp32": torch.float32, "fp16": torch.float16, "bf16": torch.bfloat16}
+
+
+def export_model(config_path, checkpoint_path, output_path, dtype="fp32", keep_enc_q=True):
+    with open(config_path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    hps = utils.HParams(**config)
+    net_g = SynthesizerTrn(
+        len(hps.symbols),
+        hps.data.filter_length // 2 + 1,
+        hps.train.segment_size // hps.data.hop_length,
+        n_speakers=hps.data.n_speakers,
+        **hps.model)
+    _ = utils.load_checkpoint(checkpoint_path, net_g, None)
+    net_g.prepare_for_inference(keep_enc_q=keep_enc_q)
+
+    state_dict = {
+        k: v.to(DTYPES[dtype]) if v.is_floating_point() else v
+        for k, v in net_g.state_dict().items()
+    }
+    torch.save(
+        {
+            "model": state_dict,
+            "config": config,
+            "dtype": dtype,
+            "keep_enc_q": keep_enc_q,
+        },
+        output_path,
+    )
+    return os.path.getsize(checkpoint_path), os.path.getsize(output_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--config", type=str, default="./configs/modified_finetune_speaker.json",
+                        help="JSON file for configuration")
+    parser.add_argument("-m", "--model", type=str, default="./OUTPUT_MODEL/G_latest.pth", help="generator checkpoint")
+    parser.add_argument("-o", "--output", type=str, default="./OUTPUT_MODEL/G_infer.pth", help="exported artifact")
+    parser.add_argument("--dtype", type=str, default="fp32", choices=list(DTYPES), help="dtype of the stored weights")
+    parser.add_argument("--keep_enc_q", type=utils.str2bool, default=True,
+                        help="keep the posterior encoder, required for voice conversion")
+    args = parser.parse_args()
+
+    before, after = export_model(args.config, args.model, args.output, args.dtype, args.keep_enc_q)
+    print(f"exported {args.output}: {before / 2 ** 20:.1f} MB -> {after / 2 ** 20:.1f} MB")
@@ -27,15 +27,19 @@ import commons
 import utils
 from data_utils import (
     TextAudioSpeakerLoader,
+    PackedTextAudioSpeakerLoader,
     TextAudioSpeakerCollate,
     DistributedBucketSampler,
+    DistributedTokenBucketSampler,
+    clear_spec_cache,
+    worker_init_fn,
 )
 from models import (
     SynthesizerTrn,
     MultiPeriodDiscriminator,
 )
 from losses import generator_loss, discriminator_loss, feature_loss, kl_loss
-from mel_processing import mel_spectrogram_torch, spec_to_mel_torch
+from mel_processing import MelFrontend, set_range_check, check_range, report_range_violations
 
 
 torch.backends.cudnn.benchmark = True
@@ -54,6 +58,8 @@ def main(log_queue: mp.Queue):
     os.environ["MASTER_PORT"] = "8000"
 
     hps = utils.get_hparams()
+    if hps.rebuild_cache:
+        clear_spec_cache(getattr(hps.data, "spec_cache_dir", None))
     mp.spawn(
         run,
         nprocs=n_gpus,
@@ -86,16 +92,38 @@ def run(rank, log_queue, n_gpus, hps):
     )
     torch.manual_seed(hps.train.seed)
     torch.cuda.set_device(rank)
-
-    train_dataset = TextAudioSpeakerLoader(hps.data.training_files, hps.data, symbols)
-    train_sampler = DistributedBucketSampler(
-        train_dataset,
-        hps.train.batch_size,
-        [32, 300, 400, 500, 600, 700, 800, 900, 1000],
-        num_replicas=n_gpus,
-        rank=rank,
-        shuffle=True,
-    )
+    set_range_check(getattr(hps.data, "range_check", "count"))
+    if not getattr(hps.data, "cleaned_text", False) and getattr(hps.data, "cleaner_cache", None) is None:
+        # cleaned texts shared by all DataLoader workers and ranks, and kept for the next run
+        hps.data.cleaner_cache = os.path.join(hps.model_dir, "cleaner_cache.db")
+
+    if getattr(hps.data, "packed_training_files", None):
+        train_dataset = PackedTextAudioSpeakerLoader(
+            hps.data.packed_training_files, hps.data, symbols
+        )
+    else:
+        train_dataset = TextAudioSpeakerLoader(
+            hps.data.training_files, hps.data, symbols
+        )
+    if getattr(hps.train, "max_frames_per_batch", None):
+        # batch by a budget of padded spectrogram frames instead of batch_size
+        train_sampler = DistributedTokenBucketSampler(
+            train_dataset,
+            hps.train.max_frames_per_batch,
+            [32, 300, 400, 500, 600, 700, 800, 900, 1000],
+            num_replicas=n_gpus,
+            rank=rank,
+            shuffle=True,
+        )
+    else:
+        train_sampler = DistributedBucketSampler(
+            train_dataset,
+            hps.train.batch_size,
+            [32, 300, 400, 500, 600, 700, 800, 900, 1000],
+            num_replicas=n_gpus,
+            rank=rank,
+            shuffle=True,
+        )
     collate_fn = TextAudioSpeakerCollate()
     train_loader = DataLoader(
         train_dataset,
@@ -104,6 +132,9 @@ def run(rank, log_queue, n_gpus, hps):
         pin_memory=True,
         collate_fn=collate_fn,
         batch_sampler=train_sampler,
+        worker_init_fn=worker_init_fn,
+        # keep workers, and what they cached and warmed up, from one epoch to the next
+        persistent_workers=True,
     )
     # train_loader = DataLoader(train_dataset, batch_size=hps.train.batch_size, num_workers=2, shuffle=False, pin_memory=True,
     #                           collate_fn=collate_fn)
@@ -111,6 +142,8 @@ def run(rank, log_queue, n_gpus, hps):
         eval_dataset = TextAudioSpeakerLoader(
             hps.data.validation_files, hps.data, symbols
         )
+        # no workers, the eval loader cleans text in this process
+        eval_dataset.warm_up()
         eval_loader = DataLoader(
             eval_dataset,
             num_workers=0,
@@ -198,6 +231,7 @@ def run(rank, log_queue, n_gpus, hps):
     )
 
     scaler = GradScaler(enabled=hps.train.fp16_run)
+    mel_frontend = MelFrontend.from_hparams(hps.data).cuda(rank)
 
     for epoch in range(epoch_str, hps.train.epochs + 1):
         if rank == 0:
@@ -212,6 +246,7 @@ def run(rank, log_queue, n_gpus, hps):
                 [train_loader, eval_loader],
                 logger,
                 [writer, writer_eval],
+                mel_frontend,
             )
         else:
             train_and_evaluate(
@@ -225,13 +260,14 @@ def run(rank, log_queue, n_gpus, hps):
                 [train_loader, None],
                 None,
                 None,
+                mel_frontend,
             )
         scheduler_g.step()
         scheduler_d.step()
 
 
 def train_and_evaluate(
-    rank, epoch, hps, nets, optims, schedulers, scaler, loaders, logger, writers
+    rank, epoch, hps, nets, optims, schedulers, scaler, loaders, logger, writers, mel_frontend
 ):
     net_g, net_d = nets
     optim_g, optim_d = optims
@@ -263,6 +299,8 @@ def train_and_evaluate(
         y, y_lengths = y.cuda(rank, non_blocking=True), y_lengths.cuda(
             rank, non_blocking=True
         )
+        # the DataLoader workers do not count, the batch is checked here instead
+        y = check_range(y)
         speakers = speakers.cuda(rank, non_blocking=True)
 
         with autocast(enabled=hps.train.fp16_run):
@@ -276,27 +314,11 @@ def train_and_evaluate(
                 (z, z_p, m_p, logs_p, m_q, logs_q),
             ) = net_g(x, x_lengths, spec, spec_lengths, speakers)
 
-            mel = spec_to_mel_torch(
-                spec,
-                hps.data.filter_length,
-                hps.data.n_mel_channels,
-                hps.data.sampling_rate,
-                hps.data.mel_fmin,
-                hps.data.mel_fmax,
-            )
+            mel = mel_frontend.spec_to_mel(spec)
             y_mel = commons.slice_segments(
                 mel, ids_slice, hps.train.segment_size // hps.data.hop_length
             )
-            y_hat_mel = mel_spectrogram_torch(
-                y_hat.squeeze(1),
-                hps.data.filter_length,
-                hps.data.n_mel_channels,
-                hps.data.sampling_rate,
-                hps.data.hop_length,
-                hps.data.win_length,
-                hps.data.mel_fmin,
-                hps.data.mel_fmax,
-            )
+            y_hat_mel = mel_frontend(y_hat.squeeze(1))
 
             y = commons.slice_segments(
                 y, ids_slice * hps.data.hop_length, hps.train.segment_size
@@ -333,6 +355,8 @@ def train_and_evaluate(
         scaler.step(optim_g)
         scaler.update()
 
+        if global_step % hps.train.log_interval == 0:
+            report_range_violations()
         if rank == 0:
             if global_step % hps.train.log_interval == 0:
                 lr = optim_g.param_groups[0]["lr"]
@@ -390,7 +414,7 @@ def train_and_evaluate(
                 )
 
             if global_step % hps.train.eval_interval == 0:
-                evaluate(hps, net_g, eval_loader, writer_eval)
+                evaluate(hps, net_g, eval_loader, writer_eval, mel_frontend)
 
                 utils.save_checkpoint(
                     net_g,
@@ -497,7 +521,7 @@ def train_and_evaluate(
         logger.info("====> Epoch: {}".format(epoch))
 
 
-def evaluate(hps, generator, eval_loader, writer_eval):
+def evaluate(hps, generator, eval_loader, writer_eval, mel_frontend):
     generator.eval()
     with torch.no_grad():
         for batch_idx, (
@@ -528,24 +552,8 @@ def evaluate(hps, generator, eval_loader, writer_eval):
         )
         y_hat_lengths = mask.sum([1, 2]).long() * hps.data.hop_length
 
-        mel = spec_to_mel_torch(
-            spec,
-            hps.data.filter_length,
-            hps.data.n_mel_channels,
-            hps.data.sampling_rate,
-            hps.data.mel_fmin,
-            hps.data.mel_fmax,
-        )
-        y_hat_mel = mel_spectrogram_torch(
-            y_hat.squeeze(1).float(),
-            hps.data.filter_length,
-            hps.data.n_mel_channels,
-            hps.data.sampling_rate,
-            hps.data.hop_length,
-            hps.data.win_length,
-            hps.data.mel_fmin,
-            hps.data.mel_fmax,
-        )
+        mel = mel_frontend.spec_to_mel(spec)
+        y_hat_mel = mel_frontend(y_hat.squeeze(1).float())
     image_dict = {
         "gen/mel": utils.plot_spectrogram_to_numpy(y_hat_mel[0].cpu().numpy())
     }
@@ -1,6 +1,7 @@
 import math
 import os
 import random
+import logging
 import torch
 from torch import nn
 import torch.nn.functional as F
@@ -15,6 +16,8 @@ from librosa.filters import mel as librosa_mel_fn
 
 MAX_WAV_VALUE = 32768.0
 
+logger = logging.getLogger(__name__)
+
 
 def dynamic_range_compression_torch(x, C=1, clip_val=1e-5):
     """
@@ -47,12 +50,45 @@ def spectral_de_normalize_torch(magnitudes):
 mel_basis = {}
 hann_window = {}
 
+# how waveforms outside [-1, 1] are handled:
+#   off:   no check
+#   clamp: clamp into [-1, 1]
+#   count: count offending samples on the device, see report_range_violations
+# off unless a training run turns it on, nothing else would ever report the counts
+range_check = "off"
+range_violations = {}
+
+
+def set_range_check(policy):
+    global range_check
+    assert policy in ("off", "clamp", "count"), "range_check should be off, clamp or count."
+    range_check = policy
+
+
+def check_range(y):
+    if range_check == "clamp":
+        return y.clamp(-1., 1.)
+    if range_check == "count":
+        device = str(y.device)
+        if device not in range_violations:
+            range_violations[device] = torch.zeros(2, dtype=torch.long, device=y.device)
+        # accumulated without reading the result back, so no host-device sync
+        range_violations[device].add_(torch.stack([(y < -1.).sum(), (y > 1.).sum()]))
+    return y
+
+
+def report_range_violations():
+    """Log and reset the counters of samples below -1 / above 1, this syncs with the device"""
+    for device, counter in range_violations.items():
+        below, above = counter.tolist()
+        if below or above:
+            logger.warning("{} samples below -1 and {} samples above 1 on {} since the last report".format(
+                below, above, device))
+        counter.zero_()
+
 
 def spectrogram_torch(y, n_fft, sampling_rate, hop_size, win_size, center=False):
-    if torch.min(y) < -1.:
-        print('min value is ', torch.min(y))
-    if torch.max(y) > 1.:
-        print('max value is ', torch.max(y))
+    y = check_range(y)
 
     global hann_window
     dtype_device = str(y.dtype) + '_' + str(y.device)
@@ -82,11 +118,65 @@ def spec_to_mel_torch(spec, n_fft, num_mels, sampling_rate, fmin, fmax):
     return spec
 
 
+class MelFrontend(nn.Module):
+    """
+    Linear / mel spectrogram frontend holding the hann window and the mel filterbank as buffers,
+    so they follow the module through .to(device) / .to(dtype) instead of being looked up per call.
+    Gives the same values as spectrogram_torch / spec_to_mel_torch / mel_spectrogram_torch.
+    """
+
+    def __init__(self, n_fft, num_mels, sampling_rate, hop_size, win_size, fmin=0.0, fmax=None):
+        super().__init__()
+        self.n_fft = n_fft
+        self.num_mels = num_mels
+        self.sampling_rate = sampling_rate
+        self.hop_size = hop_size
+        self.win_size = win_size
+        self.fmin = fmin
+        self.fmax = fmax
+        mel = librosa_mel_fn(sr=sampling_rate, n_fft=n_fft, n_mels=num_mels, fmin=fmin, fmax=fmax)
+        self.register_buffer("window", torch.hann_window(win_size), persistent=False)
+        self.register_buffer("mel_basis", torch.from_numpy(mel).float(), persistent=False)
+
+    @classmethod
+    def from_hparams(cls, hparams):
+        return cls(hparams.filter_length, hparams.n_mel_channels, hparams.sampling_rate,
+                   hparams.hop_length, hparams.win_length, hparams.mel_fmin, hparams.mel_fmax)
+
+    def spectrogram(self, y, lengths=None):
+        """
+        y: [b, t] or [b, 1, t] waveforms, zero-padded to the longest one
+        lengths: optional [b] sample lengths, the matching frame lengths are returned as well
+        returns [b, n_fft // 2 + 1, frames]
+        """
+        y = check_range(y)
+        if y.dim() == 3:
+            y = y.squeeze(1)
+        pad = int((self.n_fft - self.hop_size) / 2)
+        y = F.pad(y.unsqueeze(1), (pad, pad), mode='reflect').squeeze(1)
+
+        spec = torch.stft(y.to(self.window.dtype), self.n_fft, hop_length=self.hop_size, win_length=self.win_size,
+                          window=self.window, center=False, normalized=False, onesided=True, return_complex=True)
+        # same sum of squares and 1e-6 floor as spectrogram_torch, so the values match bit for bit
+        spec = torch.sqrt(spec.real.pow(2) + spec.imag.pow(2) + 1e-6)
+        if lengths is not None:
+            return spec, lengths // self.hop_size
+        return spec
+
+    def spec_to_mel(self, spec):
+        spec = torch.matmul(self.mel_basis.to(spec.dtype), spec)
+        return spectral_normalize_torch(spec)
+
+    def forward(self, y, lengths=None):
+        """mel spectrogram of y, see spectrogram"""
+        if lengths is not None:
+            spec, spec_lengths = self.spectrogram(y, lengths)
+            return self.spec_to_mel(spec), spec_lengths
+        return self.spec_to_mel(self.spectrogram(y))
+
+
 def mel_spectrogram_torch(y, n_fft, num_mels, sampling_rate, hop_size, win_size, fmin, fmax, center=False):
-    if torch.min(y) < -1.:
-        print('min value is ', torch.min(y))
-    if torch.max(y) > 1.:
-        print('max value is ', torch.max(y))
+    y = check_range(y)
 
     global mel_basis, hann_window
     dtype_device = str(y.dtype) + '_' + str(y.device)
@@ -256,6 +256,11 @@ class ResidualCouplingBlock(nn.Module):
                 x = flow(x, x_mask, g=g, reverse=reverse)
         return x
 
+    def remove_weight_norm(self):
+        for flow in self.flows:
+            if isinstance(flow, modules.ResidualCouplingLayer):
+                flow.remove_weight_norm()
+
 
 class PosteriorEncoder(nn.Module):
     def __init__(
@@ -298,6 +303,9 @@ class PosteriorEncoder(nn.Module):
         z = (m + torch.randn_like(m) * torch.exp(logs)) * x_mask
         return z, m, logs, x_mask
 
+    def remove_weight_norm(self):
+        self.enc.remove_weight_norm()
+
 
 class Generator(torch.nn.Module):
     def __init__(
@@ -314,6 +322,12 @@ class Generator(torch.nn.Module):
         super(Generator, self).__init__()
         self.num_kernels = len(resblock_kernel_sizes)
         self.num_upsamples = len(upsample_rates)
+        self.resblock_type = resblock
+        self.resblock_kernel_sizes = resblock_kernel_sizes
+        self.resblock_dilation_sizes = resblock_dilation_sizes
+        self.upsample_rates = upsample_rates
+        self.upsample_kernel_sizes = upsample_kernel_sizes
+        self.hop_length = math.prod(upsample_rates)
         self.conv_pre = Conv1d(
             initial_channel, upsample_initial_channel, 7, 1, padding=3
         )
@@ -347,20 +361,29 @@ class Generator(torch.nn.Module):
         if gin_channels != 0:
             self.cond = nn.Conv1d(gin_channels, upsample_initial_channel, 1)
 
-    def forward(self, x, g=None):
+    def forward(self, x, g=None, x_mask=None):
+        """
+        x_mask: optional [b, 1, t] mask of a padded batch. Every conv then sees zeros past
+          the end of each item, like the zero padding of a single item, so every item decodes
+          the same as on its own.
+        """
         x = self.conv_pre(x)
         if g is not None:
             x = x + self.cond(g)
+        if x_mask is not None:
+            x = x * x_mask
 
         for i in range(self.num_upsamples):
             x = F.leaky_relu(x, modules.LRELU_SLOPE)
             x = self.ups[i](x)
+            if x_mask is not None:
+                x_mask = torch.repeat_interleave(x_mask, self.upsample_rates[i], dim=2)
             xs = None
             for j in range(self.num_kernels):
                 if xs is None:
-                    xs = self.resblocks[i * self.num_kernels + j](x)
+                    xs = self.resblocks[i * self.num_kernels + j](x, x_mask)
                 else:
-                    xs += self.resblocks[i * self.num_kernels + j](x)
+                    xs += self.resblocks[i * self.num_kernels + j](x, x_mask)
             x = xs / self.num_kernels
         x = F.leaky_relu(x)
         x = self.conv_post(x)
@@ -368,6 +391,65 @@ class Generator(torch.nn.Module):
 
         return x
 
+    def receptive_field(self):
+        """
+        One-sided context, in input frames, that can influence an output frame.
+        """
+        frames = 3.0  # conv_pre, kernel 7
+        resolution = 1
+        for u, k in zip(self.upsample_rates, self.upsample_kernel_sizes):
+            frames += (k // u) / resolution
+            resolution *= u
+            context = 0
+            for kernel_size, dilation in zip(
+                self.resblock_kernel_sizes, self.resblock_dilation_sizes
+            ):
+                half = (kernel_size - 1) // 2
+                if self.resblock_type == "1":
+                    # every dilated conv is followed by a non-dilated one
+                    c = sum(half * d + half for d in dilation)
+                else:
+                    c = sum(half * d for d in dilation)
+                context = max(context, c)
+            frames += context / resolution
+        frames += 3.0 / resolution  # conv_post, kernel 7
+        return math.ceil(frames)
+
+    def stream(self, x, g=None, chunk_size=32, context=None, crossfade=None):
+        """
+        Decode x window by window along time, yielding waveform chunks.
+        x: [b, c, t]
+        chunk_size: input frames emitted per chunk
+        context: extra input frames decoded on each side of a window,
+          defaults to the receptive field so chunks match the full decode
+        crossfade: samples blended linearly between neighbouring chunks
+        yields: [b, 1, t'] chunks that concatenate to [b, 1, t * hop_length]
+        """
+        hop = self.hop_length
+        if context is None:
+            context = self.receptive_field()
+        if crossfade is None:
+            crossfade = hop
+        crossfade = min(crossfade, chunk_size * hop)
+        fade_in = torch.linspace(0, 1, crossfade, device=x.device, dtype=x.dtype)
+        fade_out = 1 - fade_in
+
+        t = x.size(2)
+        tail = None
+        for start in range(0, t, chunk_size):
+            end = min(start + chunk_size, t)
+            lead = crossfade if tail is not None else 0
+            lo = max(0, start - context - math.ceil(lead / hop))
+            hi = min(t, end + context)
+            o = self(x[:, :, lo:hi], g=g)
+            o = o[:, :, (start - lo) * hop - lead : (end - lo) * hop]
+            if lead > 0:
+                o[:, :, :lead] = tail * fade_out + o[:, :, :lead] * fade_in
+            if end < t and crossfade > 0:
+                tail = o[:, :, -crossfade:]
+                o = o[:, :, :-crossfade]
+            yield o
+
     def remove_weight_norm(self):
         print("Removing weight norm...")
         for l in self.ups:
@@ -538,6 +620,7 @@ class SynthesizerTrn(nn.Module):
         n_speakers=0,
         gin_channels=0,
         use_sdp=True,
+        mas_backend="cython",
         **kwargs
     ):
         super().__init__()
@@ -557,10 +640,14 @@ class SynthesizerTrn(nn.Module):
         self.upsample_initial_channel = upsample_initial_channel
         self.upsample_kernel_sizes = upsample_kernel_sizes
         self.segment_size = segment_size
+        self.hop_length = math.prod(upsample_rates)
         self.n_speakers = n_speakers
         self.gin_channels = gin_channels
 
         self.use_sdp = use_sdp
+        self.prepared_for_inference = False
+        assert mas_backend in ("cython", "torch"), "mas_backend should be cython or torch."
+        self.mas_backend = mas_backend
 
         self.enc_p = TextEncoder(
             n_vocab,
@@ -635,8 +722,12 @@ class SynthesizerTrn(nn.Module):
             neg_cent = neg_cent1 + neg_cent2 + neg_cent3 + neg_cent4
 
             attn_mask = torch.unsqueeze(x_mask, 2) * torch.unsqueeze(y_mask, -1)
+            if self.mas_backend == "torch":
+                maximum_path = monotonic_align.maximum_path_torch
+            else:
+                maximum_path = monotonic_align.maximum_path
             attn = (
-                monotonic_align.maximum_path(neg_cent, attn_mask.squeeze(1))
+                maximum_path(neg_cent, attn_mask.squeeze(1))
                 .unsqueeze(1)
                 .detach()
             )
@@ -680,6 +771,47 @@ class SynthesizerTrn(nn.Module):
         noise_scale_w=1.0,
         max_len=None,
         enable_random=(True, 0),
+    ):
+        z, y_mask, g, attn, (z_p, m_p, logs_p) = self._infer_latent(
+            x, x_lengths, sid, noise_scale, length_scale, noise_scale_w, enable_random
+        )
+        dec_mask = y_mask[:, :, :max_len]
+        # a single item has no padding to mask
+        o = self.dec(z[:, :, :max_len] * dec_mask, g=g, x_mask=dec_mask if x.size(0) > 1 else None)
+        return o, attn, y_mask, (z, z_p, m_p, logs_p)
+
+    def infer_stream(
+        self,
+        x,
+        x_lengths,
+        sid=None,
+        noise_scale=1,
+        length_scale=1,
+        noise_scale_w=1.0,
+        enable_random=(True, 0),
+        chunk_size=32,
+        crossfade=None,
+    ):
+        """
+        Same as infer, but yields the waveform in chunks from Generator.stream
+        so playback can start before the whole utterance is decoded.
+        """
+        z, y_mask, g, _, _ = self._infer_latent(
+            x, x_lengths, sid, noise_scale, length_scale, noise_scale_w, enable_random
+        )
+        yield from self.dec.stream(
+            z * y_mask, g=g, chunk_size=chunk_size, crossfade=crossfade
+        )
+
+    def _infer_latent(
+        self,
+        x,
+        x_lengths,
+        sid,
+        noise_scale,
+        length_scale,
+        noise_scale_w,
+        enable_random,
     ):
         x, m_p, logs_p, x_mask = self.enc_p(x, x_lengths)
         if self.n_speakers > 0:
@@ -710,11 +842,56 @@ class SynthesizerTrn(nn.Module):
             torch.manual_seed(enable_random[1])
         z_p = m_p + torch.randn_like(m_p) * torch.exp(logs_p) * noise_scale
         z = self.flow(z_p, y_mask, g=g, reverse=True)
-        o = self.dec((z * y_mask)[:, :, :max_len], g=g)
-        return o, attn, y_mask, (z, z_p, m_p, logs_p)
+        return z, y_mask, g, attn, (z_p, m_p, logs_p)
+
+    def infer_batch(
+        self,
+        xs,
+        sids=None,
+        noise_scale=1,
+        length_scale=1,
+        noise_scale_w=1.0,
+        max_len=None,
+        enable_random=(True, 0),
+    ):
+        """
+        Synthesize several utterances in a single forward pass.
+        xs: list of [t_x] LongTensors
+        sids, noise_scale, length_scale, noise_scale_w: a scalar shared by all
+        items or a list with one value per item
+        returns: list of [1, t_wav] waveforms trimmed to their own lengths
+        """
+        device = xs[0].device
+        x_lengths = torch.LongTensor([x.size(0) for x in xs]).to(device)
+        x = nn.utils.rnn.pad_sequence(xs, batch_first=True)
+        if sids is not None:
+            sids = torch.LongTensor(sids).to(device)
+
+        def per_item(v):
+            # [b, 1, 1] broadcasts against the [b, c, t] tensors inside infer
+            if isinstance(v, (list, tuple)):
+                return torch.FloatTensor(v).to(device).view(-1, 1, 1)
+            return v
+
+        o, attn, y_mask, _ = self.infer(
+            x,
+            x_lengths,
+            sid=sids,
+            noise_scale=per_item(noise_scale),
+            length_scale=per_item(length_scale),
+            noise_scale_w=per_item(noise_scale_w),
+            max_len=max_len,
+            enable_random=enable_random,
+        )
+        y_lengths = y_mask.sum([1, 2]).long()
+        if max_len is not None:
+            y_lengths = torch.clamp_max(y_lengths, max_len)
+        wav_lengths = (y_lengths * self.hop_length).tolist()
+        return [o[i, :, : wav_lengths[i]] for i in range(len(xs))]
 
     def voice_conversion(self, y, y_lengths, sid_src, sid_tgt):
         assert self.n_speakers > 0, "n_speakers have to be larger than 0."
+        assert self.enc_q is not None, "enc_q was dropped by prepare_for_inference."
         g_src = self.emb_g(sid_src).unsqueeze(-1)
         g_tgt = self.emb_g(sid_tgt).unsqueeze(-1)
         z, m_q, logs_q, y_mask = self.enc_q(y, y_lengths, g=g_src)
@@ -722,3 +899,19 @@ class SynthesizerTrn(nn.Module):
         z_hat = self.flow(z_p, y_mask, g=g_tgt, reverse=True)
         o_hat = self.dec(z_hat * y_mask, g=g_tgt)
         return o_hat, y_mask, (z, z_p, z_hat)
+
+    def prepare_for_inference(self, keep_enc_q=False):
+        """
+        Fold weight norm into plain conv weights in dec, flow and enc_q, drop the
+        posterior encoder unless voice conversion is needed, and switch to eval mode.
+        Call it after loading the checkpoint, the result can not be trained any more.
+        """
+        if not self.prepared_for_inference:
+            self.dec.remove_weight_norm()
+            self.flow.remove_weight_norm()
+            if self.enc_q is not None:
+                self.enc_q.remove_weight_norm()
+            self.prepared_for_inference = True
+        if not keep_enc_q:
+            self.enc_q = None
+        return self.eval()
@@ -342,6 +342,9 @@ class ResidualCouplingLayer(nn.Module):
       x = torch.cat([x0, x1], 1)
       return x
 
+  def remove_weight_norm(self):
+    self.enc.remove_weight_norm()
+
 
 class ConvFlow(nn.Module):
   def __init__(self, in_channels, filter_channels, kernel_size, n_layers, num_bins=10, tail_bound=5.0):
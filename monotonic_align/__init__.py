@@ -1,10 +1,15 @@
 import numpy as np
 import torch
-from .monotonic_align.core import maximum_path_c
+try:
+  from .monotonic_align.core import maximum_path_c
+  BACKEND = "cython"
+except ImportError:
+  # core.pyx has not been built, fall back to numba or numpy
+  from .core_py import maximum_path_c, BACKEND
 
 
-def maximum_path(neg_cent, mask):
-  """ Cython optimized version.
+def maximum_path(neg_cent, mask, kernel=maximum_path_c):
+  """ Cython optimized version, or its numba/numpy fallback when the extension is not built.
   neg_cent: [b, t_t, t_s]
   mask: [b, t_t, t_s]
   """
@@ -15,5 +20,41 @@ def maximum_path(neg_cent, mask):
 
   t_t_max = mask.sum(1)[:, 0].data.cpu().numpy().astype(np.int32)
   t_s_max = mask.sum(2)[:, 0].data.cpu().numpy().astype(np.int32)
-  maximum_path_c(path, neg_cent, t_t_max, t_s_max)
+  kernel(path, neg_cent, t_t_max, t_s_max)
   return torch.from_numpy(path).to(device=device, dtype=dtype)
+
+
+def maximum_path_torch(neg_cent, mask, max_neg_val=-1e9):
+  """ Batched torch version, runs on the device of neg_cent without a host sync.
+  Each row of the DP only depends on the previous row, so the recursion is
+  vectorized over the batch and the text axis and loops over t_t.
+  neg_cent: [b, t_t, t_s]
+  mask: [b, t_t, t_s]
+  """
+  device = neg_cent.device
+  dtype = neg_cent.dtype
+  b, t_t, t_s = neg_cent.shape
+  value = neg_cent.detach().to(torch.float32, copy=True)
+  t_t_max = mask.sum(1)[:, 0].long()
+  t_s_max = mask.sum(2)[:, 0].long()
+
+  x_range = torch.arange(t_s, device=device)
+  neg_col = value.new_full((b, 1), max_neg_val)
+  for y in range(1, t_t):
+    prev = value[:, y - 1]
+    v_cur = prev.masked_fill(x_range == y, max_neg_val)
+    v_prev = torch.cat([neg_col, prev[:, :-1]], dim=1)
+    value[:, y] += torch.maximum(v_prev, v_cur)
+
+  path = torch.zeros_like(value)
+  b_range = torch.arange(b, device=device)
+  index = t_s_max - 1
+  for y in range(t_t - 1, -1, -1):
+    active = y < t_t_max
+    path[b_range, y, index] = active.float()
+    if y > 0:
+      v_cur = value[b_range, y - 1, index]
+      v_prev = value[b_range, y - 1, (index - 1).clamp(min=0)]
+      move = active & (index != 0) & ((index == y) | (v_cur < v_prev))
+      index = index - move.long()
+  return path.to(dtype=dtype)
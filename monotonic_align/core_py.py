@@ -0,0 +1,74 @@
+"""Pure python fallbacks of core.pyx, used when the Cython extension is not built.
+maximum_path_numba compiles the same loops as core.pyx with numba when it is installed,
+maximum_path_numpy vectorizes each row of the DP over the batch otherwise.
+"""
+import numpy as np
+
+try:
+  import numba
+  from numba import prange
+except ImportError:
+  numba = None
+  prange = range
+
+
+def maximum_path_each(path, value, t_y, t_x, max_neg_val=-1e9):
+  index = t_x - 1
+
+  for y in range(t_y):
+    for x in range(max(0, t_x + y - t_y), min(t_x, y + 1)):
+      if x == y:
+        v_cur = max_neg_val
+      else:
+        v_cur = value[y-1, x]
+      if x == 0:
+        if y == 0:
+          v_prev = 0.
+        else:
+          v_prev = max_neg_val
+      else:
+        v_prev = value[y-1, x-1]
+      value[y, x] += max(v_prev, v_cur)
+
+  for y in range(t_y - 1, -1, -1):
+    path[y, index] = 1
+    if index != 0 and (index == y or value[y-1, index] < value[y-1, index-1]):
+      index = index - 1
+
+
+def maximum_path_numba(paths, values, t_ys, t_xs):
+  for i in prange(paths.shape[0]):
+    maximum_path_each(paths[i], values[i], t_ys[i], t_xs[i])
+
+
+def maximum_path_numpy(paths, values, t_ys, t_xs, max_neg_val=-1e9):
+  b, t_y, t_x = values.shape
+  x_range = np.arange(t_x)
+  for y in range(1, t_y):
+    prev = values[:, y-1]
+    v_cur = np.where(x_range == y, np.float32(max_neg_val), prev)
+    v_prev = np.empty_like(prev)
+    v_prev[:, 0] = max_neg_val
+    v_prev[:, 1:] = prev[:, :-1]
+    values[:, y] += np.maximum(v_prev, v_cur)
+
+  b_range = np.arange(b)
+  index = t_xs.astype(np.int64) - 1
+  for y in range(t_y - 1, -1, -1):
+    active = y < t_ys
+    paths[b_range[active], y, index[active]] = 1
+    if y > 0:
+      v_cur = values[b_range, y-1, index]
+      v_prev = values[b_range, y-1, np.maximum(index - 1, 0)]
+      index -= (active & (index != 0) & ((index == y) | (v_cur < v_prev))).astype(np.int64)
+
+
+if numba is not None:
+  maximum_path_each = numba.njit(nogil=True, cache=True)(maximum_path_each)
+  maximum_path_numba = numba.njit(nogil=True, parallel=True, cache=True)(maximum_path_numba)
+  maximum_path_c = maximum_path_numba
+  BACKEND = "numba"
+else:
+  maximum_path_numba = None
+  maximum_path_c = maximum_path_numpy
+  BACKEND = "numpy"
@@ -0,0 +1,73 @@
+"""Pack an annotation file and its wavs into memory-mappable blobs
+
+python pack_dataset.py -c ./configs/modified_finetune_speaker.json -o ./packed_train
+
+Writes into the output directory:
+    audio.bin   int16 samples of every utterance, back to back
+    spec.bin    linear spectrogram frames of every utterance, frame-major [frames, n_freq]
+    index.npy   int64 [N, 4] rows of (wav_offset, wav_len, spec_offset, spec_len)
+    meta.json   STFT parameters and the (audiopath, speaker id, text) of every row
+
+Set "packed_training_files" in the data section of the config to the output
+directory to train from the pack with data_utils.PackedTextAudioSpeakerLoader.
+"""
+import os
+import json
+import argparse
+import numpy as np
+import torch
+from tqdm import tqdm
+
+import utils
+from data_utils import TextAudioSpeakerLoader
+
+
+def pack_dataset(filelist, hps, output_dir, fp16=False):
+    os.makedirs(output_dir, exist_ok=True)
+    dataset = TextAudioSpeakerLoader(filelist, hps.data, hps.symbols)
+    spec_dtype = np.float16 if fp16 else np.float32
+
+    index = []
+    wav_offset = 0
+    spec_offset = 0
+    n_freq = hps.data.filter_length // 2 + 1
+    with open(os.path.join(output_dir, "audio.bin"), "wb") as audio_file, \
+            open(os.path.join(output_dir, "spec.bin"), "wb") as spec_file:
+        for audiopath, sid, text in tqdm(dataset.audiopaths_sid_text):
+            spec, audio_norm = dataset.get_audio(audiopath)
+            audio = torch.clamp(torch.round(audio_norm[0] * 32768.0), -32768, 32767)
+            audio_file.write(audio.numpy().astype(np.int16).tobytes())
+            spec_file.write(spec.transpose(0, 1).contiguous().numpy().astype(spec_dtype).tobytes())
+            index.append([wav_offset, audio.size(0), spec_offset, spec.size(1)])
+            wav_offset += audio.size(0)
+            spec_offset += spec.size(1)
+
+    np.save(os.path.join(output_dir, "index.npy"), np.asarray(index, dtype=np.int64))
+    meta = {
+        "sampling_rate": hps.data.sampling_rate,
+        "filter_length": hps.data.filter_length,
+        "hop_length": hps.data.hop_length,
+        "win_length": hps.data.win_length,
+        "n_freq": n_freq,
+        "spec_dtype": np.dtype(spec_dtype).name,
+        "entries": dataset.audiopaths_sid_text,
+    }
+    with open(os.path.join(output_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    return len(index)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--config", type=str, default="./configs/modified_finetune_speaker.json",
+                        help="JSON file for configuration")
+    parser.add_argument("-f", "--filelist", type=str, default=None,
+                        help="annotation file to pack, defaults to training_files in the config")
+    parser.add_argument("-o", "--output_dir", type=str, default="./packed_train", help="output directory")
+    parser.add_argument("--fp16", type=utils.str2bool, default=False, help="store spectrograms as float16")
+    args = parser.parse_args()
+
+    hps = utils.get_hparams_from_file(args.config)
+    filelist = args.filelist if args.filelist is not None else hps.data.training_files
+    n = pack_dataset(filelist, hps, args.output_dir, fp16=args.fp16)
+    print(f"packed {n} utterances into {args.output_dir}")
@@ -15,6 +15,11 @@ if __name__ == "__main__":
         help="Whether to add extra data as fine-tuning helper",
     )
     parser.add_argument("--languages", default="CJE")
+    parser.add_argument(
+        "--cleaner_cache",
+        default="./cleaner_cache.db",
+        help="sqlite file of cleaned texts kept between runs, an empty string disables it",
+    )
     args = parser.parse_args()
     if args.languages == "CJE":
         langs = ["[ZH]", "[JA]", "[EN]"]
@@ -91,26 +96,25 @@ if __name__ == "__main__":
         # STEP 3: clean annotations, replace speaker names with assigned speaker IDs
         import text
 
-        cleaned_new_annos = []
-        for i, line in enumerate(new_annos):
-            path, speaker, txt = line.split("|")
-            if len(txt) > 150:
-                continue
-            cleaned_text = text._clean_text(txt, hps["data"]["text_cleaners"])
-            cleaned_text += "\n" if not cleaned_text.endswith("\n") else ""
-            cleaned_new_annos.append(
-                path + "|" + str(speaker2id[speaker]) + "|" + cleaned_text
-            )
-        cleaned_old_annos = []
-        for i, line in enumerate(old_annos):
-            path, speaker, txt = line.split("|")
-            if len(txt) > 150:
-                continue
-            cleaned_text = text._clean_text(txt, hps["data"]["text_cleaners"])
-            cleaned_text += "\n" if not cleaned_text.endswith("\n") else ""
-            cleaned_old_annos.append(
-                path + "|" + str(speaker2id[speaker]) + "|" + cleaned_text
+        cache = text.enable_cache(args.cleaner_cache or None)
+
+        def clean_annos(annos):
+            annos = [line.split("|") for line in annos]
+            annos = [(path, speaker, txt) for path, speaker, txt in annos if len(txt) <= 150]
+            # all texts at once, cleaned on every core
+            cleaned_texts = text.clean_texts(
+                [txt for _, _, txt in annos], hps["data"]["text_cleaners"]
             )
+            cleaned_annos = []
+            for (path, speaker, _), cleaned_text in zip(annos, cleaned_texts):
+                cleaned_text += "\n" if not cleaned_text.endswith("\n") else ""
+                cleaned_annos.append(
+                    path + "|" + str(speaker2id[speaker]) + "|" + cleaned_text
+                )
+            return cleaned_annos
+
+        cleaned_new_annos = clean_annos(new_annos)
+        cleaned_old_annos = clean_annos(old_annos)
         # merge with old annotation
         final_annos = cleaned_old_annos + cc_duplicate * cleaned_new_annos
         # save annotation file
@@ -121,6 +125,7 @@ if __name__ == "__main__":
         with open("./final_annotation_val.txt", "w", encoding="utf-8") as f:
             for line in cleaned_new_annos:
                 f.write(line)
+        print("cleaner cache: {}".format(cache.stats()))
         print("finished")
     else:
         # Do not add extra helper data
@@ -150,14 +155,17 @@ if __name__ == "__main__":
         # STEP 2: clean annotations, replace speaker names with assigned speaker IDs
         import text
 
+        cache = text.enable_cache(args.cleaner_cache or None)
+
+        annos = [line.split("|") for line in new_annos]
+        annos = [(path, speaker, txt) for path, speaker, txt in annos if len(txt) <= 150]
+        # all texts at once, cleaned on every core
+        cleaned_texts = text.clean_texts(
+            [txt for _, _, txt in annos], hps["data"]["text_cleaners"]
+        )
         cleaned_new_annos = []
-        for i, line in enumerate(new_annos):
-            path, speaker, txt = line.split("|")
-            if len(txt) > 150:
-                continue
-            cleaned_text = text._clean_text(txt, hps["data"]["text_cleaners"]).replace(
-                "[ZH]", ""
-            )
+        for (path, speaker, _), cleaned_text in zip(annos, cleaned_texts):
+            cleaned_text = cleaned_text.replace("[ZH]", "")
             cleaned_text += "\n" if not cleaned_text.endswith("\n") else ""
             cleaned_new_annos.append(
                 path + "|" + str(speaker2id[speaker]) + "|" + cleaned_text
@@ -172,4 +180,5 @@ if __name__ == "__main__":
         with open("./final_annotation_val.txt", "w", encoding="utf-8") as f:
             for line in cleaned_new_annos:
                 f.write(line)
+        print("cleaner cache: {}".format(cache.stats()))
         print("finished")
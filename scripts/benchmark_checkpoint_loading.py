@@ -0,0 +1,59 @@
+"""Time utils.load_checkpoint into a fresh SynthesizerTrn with the available loading paths.
+
+python scripts/benchmark_checkpoint_loading.py -c ./configs/modified_finetune_speaker.json -m ./OUTPUT_MODEL/G_latest.pth
+
+Convert the checkpoint with convert_checkpoint.py first to include safetensors.
+Run it on a cold page cache (or twice) to see both the disk-bound and the copy-bound case.
+"""
+import os
+import sys
+import argparse
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils
+from models import SynthesizerTrn
+
+
+def build_model(hps):
+    return SynthesizerTrn(
+        len(hps.symbols),
+        hps.data.filter_length // 2 + 1,
+        hps.train.segment_size // hps.data.hop_length,
+        n_speakers=hps.data.n_speakers,
+        **hps.model).eval()
+
+
+def legacy_load_checkpoint(checkpoint_path, model):
+    # full read, then copy into the model, as before mmap loading
+    checkpoint_dict = torch.load(checkpoint_path, map_location="cpu")
+    model.load_state_dict(checkpoint_dict["model"], strict=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--config", type=str, default="./configs/modified_finetune_speaker.json")
+    parser.add_argument("-m", "--model", type=str, required=True, help=".pth generator checkpoint")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    hps = utils.get_hparams_from_file(args.config)
+    safetensors_path = os.path.splitext(args.model)[0] + ".safetensors"
+    loaders = [
+        ("torch.load", lambda m: legacy_load_checkpoint(args.model, m)),
+        ("mmap", lambda m: utils.load_checkpoint(args.model, m, None)),
+        ("mmap+assign", lambda m: utils.load_checkpoint(args.model, m, None, assign=True)),
+    ]
+    if os.path.exists(safetensors_path):
+        loaders.append(("safetensors", lambda m: utils.load_checkpoint(safetensors_path, m, None, assign=True)))
+
+    for name, load in loaders:
+        seconds = 0.0
+        for _ in range(args.repeat):
+            model = build_model(hps)
+            start = time.perf_counter()
+            load(model)
+            seconds += time.perf_counter() - start
+        print(f"{name:>12}: {seconds / args.repeat * 1e3:.1f} ms")
@@ -0,0 +1,50 @@
+"""Cold start cost of the text frontend: `import text` in a fresh interpreter, then the first
+cleaning of each language tag, which is when its backend is imported (see text.cleaners._lazy).
+
+python scripts/benchmark_import_time.py [--cleaner cjke_cleaners2] [--repeat 3]
+"""
+import os
+import sys
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SAMPLES = {
+    "JA": "[JA]こんにちは。[JA]",
+    "ZH": "[ZH]你好。[ZH]",
+    "KO": "[KO]안녕하세요.[KO]",
+    "EN": "[EN]Hello.[EN]",
+}
+
+PROGRAM = """
+import sys, time
+start = time.perf_counter()
+import text
+imported = time.perf_counter()
+if {text!r}:
+    text._clean_text({text!r}, [{cleaner!r}])
+print(imported - start, time.perf_counter() - imported)
+"""
+
+
+def run(text, cleaner):
+    output = subprocess.run(
+        [sys.executable, "-c", PROGRAM.format(text=text, cleaner=cleaner)],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    ).stdout.split()
+    return float(output[-2]), float(output[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cleaner", type=str, default="cjke_cleaners2")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    cases = [("import text", "")] + [(f"first [{tag}]", sample) for tag, sample in SAMPLES.items()]
+    for name, sample in cases:
+        timings = [run(sample, args.cleaner) for _ in range(args.repeat)]
+        import_time = min(t[0] for t in timings)
+        first_call = min(t[1] for t in timings)
+        print(f"{name:<12} import {import_time * 1e3:8.1f} ms, first clean {first_call * 1e3:8.1f} ms")
@@ -0,0 +1,62 @@
+"""Real-time factor of SynthesizerTrn.infer before and after prepare_for_inference.
+
+python scripts/benchmark_inference.py -c ./configs/modified_finetune_speaker.json -m ./OUTPUT_MODEL/G_latest.pth
+"""
+import os
+import sys
+import argparse
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils
+from models import SynthesizerTrn
+
+
+def measure_rtf(net_g, hps, x, repeat, device):
+    x_lengths = torch.LongTensor([x.size(1)]).to(device)
+    sid = torch.LongTensor([0]).to(device)
+    with torch.no_grad():
+        net_g.infer(x, x_lengths, sid=sid)
+        if device.startswith("cuda"):
+            torch.cuda.synchronize()
+        seconds = 0.0
+        samples = 0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            audio = net_g.infer(x, x_lengths, sid=sid, noise_scale=0.667, noise_scale_w=0.8)[0]
+            if device.startswith("cuda"):
+                torch.cuda.synchronize()
+            seconds += time.perf_counter() - start
+            samples += audio.size(-1)
+    return seconds / (samples / hps.data.sampling_rate)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--config", type=str, default="./configs/modified_finetune_speaker.json")
+    parser.add_argument("-m", "--model", type=str, default=None, help="generator checkpoint, random weights if omitted")
+    parser.add_argument("--device", type=str, default="cuda:0" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--text_len", type=int, default=100, help="number of symbols per utterance")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    hps = utils.get_hparams_from_file(args.config)
+    net_g = SynthesizerTrn(
+        len(hps.symbols),
+        hps.data.filter_length // 2 + 1,
+        hps.train.segment_size // hps.data.hop_length,
+        n_speakers=hps.data.n_speakers,
+        **hps.model).to(args.device)
+    _ = net_g.eval()
+    if args.model is not None:
+        _ = utils.load_checkpoint(args.model, net_g, None)
+
+    torch.manual_seed(1234)
+    x = torch.randint(1, len(hps.symbols), (1, args.text_len)).to(args.device)
+    before = measure_rtf(net_g, hps, x, args.repeat, args.device)
+    net_g.prepare_for_inference()
+    after = measure_rtf(net_g, hps, x, args.repeat, args.device)
+    print(f"RTF with weight norm: {before:.4f}")
+    print(f"RTF after prepare_for_inference: {after:.4f} ({before / after:.2f}x)")
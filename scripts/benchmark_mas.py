@@ -0,0 +1,65 @@
+"""Benchmark of the monotonic alignment search backends
+(Cython when built, numba when installed, numpy and torch).
+Their parity is checked by tests/test_monotonic_align.py.
+
+python scripts/benchmark_mas.py --device cuda
+"""
+import os
+import sys
+import argparse
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import commons
+import monotonic_align
+from monotonic_align import core_py
+
+
+def make_inputs(batch_size, t_s, t_t, device):
+    # random lengths with t_s <= t_t, as in training where a frame never covers two phonemes
+    x_lengths = torch.randint(t_s // 2, t_s + 1, (batch_size,), device=device)
+    y_lengths = torch.randint(t_t // 2, t_t + 1, (batch_size,), device=device)
+    x_lengths[0], y_lengths[0] = t_s, t_t
+    y_lengths = torch.maximum(y_lengths, x_lengths)
+    x_mask = commons.sequence_mask(x_lengths, t_s).float()
+    y_mask = commons.sequence_mask(y_lengths, t_t).float()
+    mask = y_mask.unsqueeze(2) * x_mask.unsqueeze(1)  # [b, t_t, t_s]
+    neg_cent = torch.randn(batch_size, t_t, t_s, device=device) * 10
+    return neg_cent, mask
+
+
+def timed(fn, neg_cent, mask, repeat):
+    fn(neg_cent, mask)
+    if neg_cent.is_cuda:
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(neg_cent, mask)
+    if neg_cent.is_cuda:
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeat
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    backends = []
+    if monotonic_align.BACKEND == "cython":
+        backends.append(("cython", monotonic_align.maximum_path))
+    if core_py.maximum_path_numba is not None:
+        backends.append(("numba", lambda n, m: monotonic_align.maximum_path(n, m, core_py.maximum_path_numba)))
+    backends.append(("numpy", lambda n, m: monotonic_align.maximum_path(n, m, core_py.maximum_path_numpy)))
+    backends.append(("torch", monotonic_align.maximum_path_torch))
+    print(f"default backend: {monotonic_align.BACKEND}")
+
+    for batch_size, t_s, t_t in [(1, 50, 200), (16, 50, 200), (16, 100, 400), (32, 150, 800), (64, 200, 1000)]:
+        neg_cent, mask = make_inputs(batch_size, t_s, t_t, args.device)
+        timings = ", ".join(
+            f"{name} {timed(fn, neg_cent, mask, args.repeat) * 1e3:.2f} ms" for name, fn in backends
+        )
+        print(f"b={batch_size:<3} t_s={t_s:<4} t_t={t_t:<5} {timings}")
@@ -0,0 +1,72 @@
+"""Benchmark of the compiled transliteration tables (text.rules.RuleTable) against applying
+their rules one re.sub at a time. Their parity is checked by tests/test_text_tables.py.
+
+python scripts/benchmark_rules.py [--filelist filelists/train.txt.cleaned]
+"""
+import os
+import re
+import sys
+import argparse
+import random
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from text import mandarin, korean, japanese
+
+TABLES = [
+    (mandarin, "_latin_to_bopomofo"),
+    (mandarin, "_bopomofo_to_romaji"),
+    (mandarin, "_romaji_to_ipa"),
+    (mandarin, "_bopomofo_to_ipa"),
+    (mandarin, "_bopomofo_to_ipa2"),
+    (korean, "_hangul_divided"),
+    (korean, "_latin_to_hangul"),
+    (korean, "_ipa_to_lazy_ipa"),
+    (japanese, "_romaji_to_ipa"),
+    (japanese, "_romaji_to_ipa2"),
+]
+
+
+def sequential(rules, text):
+    for regex, replacement in rules:
+        text = re.sub(regex, replacement, text)
+    return text
+
+
+def random_texts(rules, n, max_len):
+    # strings over everything the rules match or produce, the cases where merging could go wrong
+    alphabet = sorted({c for regex, replacement in rules for c in regex.pattern + replacement} | set(" ,.↑↓"))
+    return ["".join(random.choice(alphabet) for _ in range(random.randint(0, max_len))) for _ in range(n)]
+
+
+def timed(fn, texts, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            fn(text)
+    return (time.perf_counter() - start) / repeat
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--filelist", type=str, default=None, help="also check the text column of a filelist")
+    parser.add_argument("--samples", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    random.seed(1234)
+
+    corpus = []
+    if args.filelist is not None:
+        with open(args.filelist, encoding="utf-8") as f:
+            corpus = [line.rstrip("\n").split("|")[-1] for line in f]
+
+    for module, name in TABLES:
+        rules = getattr(module, name)
+        table = getattr(module, name + "_table")
+        texts = random_texts(rules, args.samples, 40) + corpus
+        before = timed(lambda t: sequential(rules, t), texts, args.repeat)
+        after = timed(table, texts, args.repeat)
+        print(
+            f"{module.__name__}.{name:<22} {len(rules):>3} rules -> {len(table.stages)} passes, "
+            f"{before * 1e3:8.2f} ms -> {after * 1e3:8.2f} ms ({before / after:.1f}x)"
+        )
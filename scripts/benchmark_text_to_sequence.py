@@ -0,0 +1,44 @@
+"""Micro-benchmark for converting cleaned text to symbol ids.
+tests/test_text_tables.py checks that both give the same ids.
+
+python scripts/benchmark_text_to_sequence.py -c ./configs/modified_finetune_speaker.json
+"""
+import os
+import sys
+import argparse
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils
+from text import cleaned_text_to_sequence
+
+
+def legacy_cleaned_text_to_sequence(cleaned_text, symbols):
+    # the implementation before the symbol table was cached
+    symbol_to_id = {s: i for i, s in enumerate(symbols)}
+    sequence = [
+        symbol_to_id[symbol] for symbol in cleaned_text if symbol in symbol_to_id.keys()
+    ]
+    return sequence
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--config", type=str, default="./configs/modified_finetune_speaker.json")
+    parser.add_argument("-f", "--filelist", type=str, default=None, help="annotation file with cleaned text")
+    parser.add_argument("-n", "--number", type=int, default=20000)
+    args = parser.parse_args()
+
+    hps = utils.get_hparams_from_file(args.config)
+    symbols = hps.symbols
+    if args.filelist is not None:
+        texts = [line[2] for line in utils.load_filepaths_and_text(args.filelist)]
+    else:
+        texts = ["ni↓xaʊ↓↑, wɔ↓↑ ʃi↓ ɥæn↑tʃʰy↓ ʃjɑʊ↓↑tʃjɛ↓↑. kɔnnitʃiwa↓."] * 100
+
+    for name, fn in [("legacy", legacy_cleaned_text_to_sequence), ("cached", cleaned_text_to_sequence)]:
+        seconds = timeit.timeit(
+            lambda: [fn(text, symbols) for text in texts], number=max(1, args.number // len(texts))
+        )
+        per_utterance = seconds / (max(1, args.number // len(texts)) * len(texts))
+        print(f"{name:>8}: {per_utterance * 1e6:.2f} us / utterance")
@@ -0,0 +1,70 @@
+"""Load generator for server.py, reports latency percentiles and throughput.
+
+python scripts/load_test.py --url http://127.0.0.1:8080/tts --speaker <name> -n 200 --concurrency 16
+"""
+import json
+import time
+import asyncio
+import argparse
+from urllib.parse import urlsplit
+
+
+async def post(host, port, path, body):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(
+        "POST {} HTTP/1.1\r\nHost: {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n"
+        "Connection: close\r\n\r\n".format(path, host, len(body)).encode("latin-1") + body
+    )
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    status = int(response.split(b" ", 2)[1])
+    return status, len(response)
+
+
+async def main(args):
+    url = urlsplit(args.url)
+    texts = [args.text] if args.text_file is None else [
+        line.strip() for line in open(args.text_file, encoding="utf-8") if line.strip()
+    ]
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(i):
+        nonlocal errors
+        body = json.dumps({
+            "text": texts[i % len(texts)],
+            "speaker": args.speaker,
+            "language": args.language,
+        }, ensure_ascii=False).encode("utf-8")
+        async with semaphore:
+            start = time.perf_counter()
+            status, _ = await post(url.hostname, url.port or 80, url.path, body)
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(args.number)])
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    if latencies:
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"p50 {p50 * 1e3:.1f} ms, p99 {p99 * 1e3:.1f} ms")
+    print(f"{len(latencies)} ok, {errors} errors, {len(latencies) / elapsed:.2f} requests/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", type=str, default="http://127.0.0.1:8080/tts")
+    parser.add_argument("--speaker", type=str, required=True)
+    parser.add_argument("--language", type=str, default="日本語")
+    parser.add_argument("--text", type=str, default="こんにちは、今日はいい天気ですね。")
+    parser.add_argument("--text_file", type=str, default=None, help="one text per line, used round robin")
+    parser.add_argument("-n", "--number", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    asyncio.run(main(parser.parse_args()))
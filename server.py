@@ -0,0 +1,344 @@
+"""HTTP synthesis server with request micro-batching, standard library only
+
+python server.py -m ./characters/some_character --port 8080
+
+POST /tts   JSON {"text", "speaker", "language", "speed", "noise_scale", "noise_scale_w"}
+            -> audio/wav, language is one of cmd_inference.language_marks (default 日本語)
+POST /tts/stream   same JSON -> chunked audio/wav, a header of unknown length first, then the
+            samples of each sentence as the decoder produces them (see SynthesizerTrn.infer_stream)
+POST /vc?source=<speaker>&target=<speaker>   body: wav file -> audio/wav
+GET  /speakers   -> JSON list of speaker names
+GET  /stats   -> JSON hit rate of the cleaned text cache (text.cache, --cleaner_cache)
+
+Bodies larger than --max_body_mb are refused with 413 before they are read.
+
+TTS requests arriving within --max_wait_ms of each other are synthesized together with
+SynthesizerTrn.infer_batch (up to --max_batch_size). All model calls run on one worker thread,
+text cleaning runs on the default thread pool so it overlaps with inference.
+"""
+import io
+import json
+import math
+import asyncio
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+import torch
+import librosa
+from scipy.io.wavfile import read
+
+import utils
+from text import enable_cache, initialize as initialize_text
+from utils import get_text, language_marks, split_long_text
+from mel_processing import MelFrontend
+
+logging.basicConfig(level=logging.INFO, format="[%(levelname)-8s %(name)-12s]  %(message)s")
+logger = logging.getLogger("server")
+
+device = "cuda:0" if torch.cuda.is_available() else "cpu"
+
+STATUS = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class MicroBatcher:
+    """
+    Collects submitted items for up to max_wait seconds (or max_batch_size items)
+    and hands them to run_batch on the model thread as one list
+    """
+
+    def __init__(self, run_batch, executor, max_batch_size=8, max_wait=0.01):
+        self.run_batch = run_batch
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+
+    async def submit(self, item):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                results = await loop.run_in_executor(self.executor, self.run_batch, [item for item, _ in batch])
+            except Exception as e:
+                logger.exception("batch of %d failed", len(batch))
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+
+class SynthesisServer:
+    def __init__(self, net_g, hps, max_batch_size=8, max_wait=0.01, chunk_size=32, cleaner_cache=None,
+                 max_body_bytes=32 * 2 ** 20):
+        self.net_g = net_g
+        self.hps = hps
+        self.chunk_size = chunk_size
+        self.max_body_bytes = max_body_bytes
+        self.frontend = MelFrontend.from_hparams(hps.data).to(device)
+        # one thread owns the model, so requests never run on it concurrently
+        self.model_executor = ThreadPoolExecutor(max_workers=1)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batcher = None
+        # common phrases are cleaned once, not on every request
+        self.cleaner_cache = enable_cache(cleaner_cache)
+
+    def synthesize_batch(self, items):
+        """items: [(text ids, speaker id, length_scale, noise_scale, noise_scale_w)]"""
+        with torch.no_grad():
+            audios = self.net_g.infer_batch(
+                [item[0].to(device) for item in items],
+                sids=[item[1] for item in items],
+                length_scale=[item[2] for item in items],
+                noise_scale=[item[3] for item in items],
+                noise_scale_w=[item[4] for item in items],
+            )
+        logger.info("synthesized a batch of %d", len(items))
+        return [audio[0].data.cpu().float().numpy() for audio in audios]
+
+    def convert(self, audio, source_id, target_id):
+        with torch.no_grad():
+            y = torch.FloatTensor(audio).to(device).unsqueeze(0)
+            y = y / y.abs().max().clamp(min=1e-5) * 0.99
+            spec = self.frontend.spectrogram(y)
+            spec_lengths = torch.LongTensor([spec.size(-1)]).to(device)
+            sid_src = torch.LongTensor([source_id]).to(device)
+            sid_tgt = torch.LongTensor([target_id]).to(device)
+            audio = self.net_g.voice_conversion(spec, spec_lengths, sid_src=sid_src, sid_tgt=sid_tgt)[0]
+        return audio[0, 0].data.cpu().float().numpy()
+
+    def speaker_id(self, name):
+        if name not in self.hps.speakers:
+            raise HTTPError(400, "unknown speaker {}".format(name))
+        return self.hps.speakers[name]
+
+    def stream_sentence(self, stn_tst, speaker_id, scales, put):
+        """Runs on the model thread, put() every decoded chunk as pcm bytes and None when done"""
+        try:
+            with torch.no_grad():
+                x_tst = stn_tst.unsqueeze(0).to(device)
+                x_tst_lengths = torch.LongTensor([stn_tst.size(0)]).to(device)
+                sid = torch.LongTensor([speaker_id]).to(device)
+                length_scale, noise_scale, noise_scale_w = scales
+                for o in self.net_g.infer_stream(x_tst, x_tst_lengths, sid=sid, noise_scale=noise_scale,
+                                                 length_scale=length_scale, noise_scale_w=noise_scale_w,
+                                                 chunk_size=self.chunk_size):
+                    put(utils.pcm16(o[0, 0].data.cpu().float().numpy()))
+        finally:
+            put(None)
+
+    def parse_tts(self, body):
+        try:
+            request = json.loads(body)
+            text = request["text"]
+            language = request.get("language", "日本語")
+            speed = float(request.get("speed", 1.0))
+            if not (math.isfinite(speed) and speed > 0):
+                raise ValueError("speed should be a positive number, got {}".format(speed))
+            scales = (
+                1.0 / speed,
+                float(request.get("noise_scale", 0.667)),
+                float(request.get("noise_scale_w", 0.6)),
+            )
+            if language not in language_marks:
+                raise KeyError(language)
+        except (ValueError, KeyError, TypeError) as e:
+            raise HTTPError(400, "bad request: {}".format(e))
+        return text, language, self.speaker_id(request.get("speaker")), scales
+
+    async def tts(self, body):
+        text, language, speaker_id, scales = self.parse_tts(body)
+        marks = language_marks[language]
+        loop = asyncio.get_running_loop()
+        stn_tst = await loop.run_in_executor(None, get_text, marks + text + marks, self.hps, False)
+        audio = await self.batcher.submit((stn_tst, speaker_id) + scales)
+        return utils.wav_bytes(audio, self.hps.data.sampling_rate)
+
+    async def tts_stream(self, body):
+        text, language, speaker_id, scales = self.parse_tts(body)
+        loop = asyncio.get_running_loop()
+        # clean every sentence up front on the thread pool, synthesis of the first one
+        # starts as soon as it is ready while the rest are still being cleaned
+        cleaned = [
+            loop.run_in_executor(None, get_text, sentence, self.hps, False)
+            for sentence in split_long_text(text, language)
+        ]
+        yield utils.wav_header(self.hps.data.sampling_rate)
+        for future in cleaned:
+            stn_tst = await future
+            chunks = asyncio.Queue()
+            done = loop.run_in_executor(
+                self.model_executor, self.stream_sentence, stn_tst, speaker_id, scales,
+                lambda chunk: loop.call_soon_threadsafe(chunks.put_nowait, chunk),
+            )
+            while True:
+                chunk = await chunks.get()
+                if chunk is None:
+                    break
+                yield chunk
+            await done
+
+    def load_wav(self, body):
+        """float32 mono samples of a wav body at the model sampling rate"""
+        try:
+            sampling_rate, audio = read(io.BytesIO(body))
+        except ValueError as e:
+            raise HTTPError(400, "body is not a wav file: {}".format(e))
+        if np.issubdtype(audio.dtype, np.integer):
+            audio = audio / np.iinfo(audio.dtype).max
+        audio = audio.astype(np.float32)
+        if audio.ndim > 1:
+            audio = librosa.to_mono(audio.transpose(1, 0))
+        if sampling_rate != self.hps.data.sampling_rate:
+            audio = librosa.resample(audio, orig_sr=sampling_rate, target_sr=self.hps.data.sampling_rate)
+        return audio
+
+    async def vc(self, query, body):
+        source_id = self.speaker_id(query.get("source", [None])[0])
+        target_id = self.speaker_id(query.get("target", [None])[0])
+        loop = asyncio.get_running_loop()
+        # decoding and resampling stay off the event loop, like text cleaning for tts
+        audio = await loop.run_in_executor(None, self.load_wav, body)
+        audio = await loop.run_in_executor(self.model_executor, self.convert, audio, source_id, target_id)
+        return utils.wav_bytes(audio, self.hps.data.sampling_rate)
+
+    async def route(self, method, target, body):
+        url = urlsplit(target)
+        if method == "GET" and url.path == "/speakers":
+            return "application/json", json.dumps(list(self.hps.speakers.keys()), ensure_ascii=False).encode("utf-8")
+        if method == "GET" and url.path == "/stats":
+            return "application/json", json.dumps(self.cleaner_cache.stats()).encode("utf-8")
+        if method == "POST" and url.path == "/tts":
+            return "audio/wav", await self.tts(body)
+        if method == "POST" and url.path == "/tts/stream":
+            # validate before the 200 goes out, errors after that can only close the connection
+            self.parse_tts(body)
+            return "audio/wav", self.tts_stream(body)
+        if method == "POST" and url.path == "/vc":
+            return "audio/wav", await self.vc(parse_qs(url.query), body)
+        raise HTTPError(404, "no route for {} {}".format(method, url.path))
+
+    def content_length(self, headers):
+        value = headers.get("content-length", "0")
+        try:
+            length = int(value)
+        except ValueError:
+            raise HTTPError(400, "bad Content-Length {!r}".format(value))
+        if length < 0:
+            raise HTTPError(400, "bad Content-Length {!r}".format(value))
+        if length > self.max_body_bytes:
+            raise HTTPError(413, "body of {} bytes is larger than the limit of {} bytes".format(
+                length, self.max_body_bytes))
+        return length
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            if len(request_line) != 3:
+                return
+            method, target, _ = request_line
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            try:
+                body = await reader.readexactly(self.content_length(headers))
+                status, (content_type, payload) = 200, await self.route(method, target, body)
+            except HTTPError as e:
+                status, content_type, payload = e.status, "text/plain", str(e).encode("utf-8")
+            except Exception as e:
+                logger.exception("%s %s failed", method, target)
+                status, content_type, payload = 500, "text/plain", str(e).encode("utf-8")
+            if isinstance(payload, bytes):
+                writer.write(
+                    "HTTP/1.1 {} {}\r\nContent-Type: {}\r\nContent-Length: {}\r\nConnection: close\r\n\r\n".format(
+                        status, STATUS[status], content_type, len(payload)
+                    ).encode("latin-1") + payload
+                )
+                await writer.drain()
+            else:
+                writer.write(
+                    "HTTP/1.1 {} {}\r\nContent-Type: {}\r\nTransfer-Encoding: chunked\r\nConnection: close\r\n\r\n".format(
+                        status, STATUS[status], content_type
+                    ).encode("latin-1")
+                )
+                try:
+                    async for chunk in payload:
+                        writer.write(b"%x\r\n" % len(chunk) + chunk + b"\r\n")
+                        await writer.drain()
+                    writer.write(b"0\r\n\r\n")
+                    await writer.drain()
+                except (ConnectionError, asyncio.CancelledError):
+                    raise
+                except Exception:
+                    logger.exception("%s %s failed while streaming", method, target)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        # created inside the running loop, asyncio.Queue binds to the current loop on python 3.8
+        self.batcher = MicroBatcher(self.synthesize_batch, self.model_executor, self.max_batch_size, self.max_wait)
+        batcher = asyncio.ensure_future(self.batcher.run())
+        server = await asyncio.start_server(self.handle, host, port)
+        logger.info("Serving on http://%s:%d (device %s)", host, port, device)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--model_dir", type=str, required=True, help="character folder, see VC_inference")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max_batch_size", type=int, default=None,
+                        help="most TTS requests per forward pass, default 8 on GPU and 1 on CPU where batching does not pay off")
+    parser.add_argument("--max_wait_ms", type=float, default=10, help="how long a request waits for others to batch with")
+    parser.add_argument("--chunk_size", type=int, default=32, help="latent frames per streamed decoder window")
+    parser.add_argument("--cleaner_cache", type=str, default=None, help="sqlite file of cleaned texts, shared between servers")
+    parser.add_argument("--max_body_mb", type=float, default=32, help="largest request body read into memory")
+    args = parser.parse_args()
+    if args.max_batch_size is None:
+        args.max_batch_size = 8 if device.startswith("cuda") else 1
+
+    net_g, hps = utils.load_character_model(args.model_dir, device)
+    # load jieba etc. now rather than on the first request
+    initialize_text(hps.data.text_cleaners, getattr(hps.data, "jieba_cache", None))
+    server = SynthesisServer(
+        net_g, hps, args.max_batch_size, args.max_wait_ms / 1000, args.chunk_size, args.cleaner_cache,
+        int(args.max_body_mb * 2 ** 20),
+    )
+    asyncio.run(server.serve(args.host, args.port))
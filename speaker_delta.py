@@ -0,0 +1,196 @@
+"""Store fine-tuned characters as deltas against one shared base model
+
+python speaker_delta.py -b ./characters/base -m ./characters/some_character [-r 32]
+
+writes <character>/OUTPUT_MODEL/delta.pth. VC_inference --base_model loads the base once and
+swaps a character's delta into it whenever that character is used, computing the delta on
+first use if the file is missing.
+
+Deltas are taken between weight-norm folded models (see SynthesizerTrn.prepare_for_inference).
+Each entry of a delta is one of
+    ("dense", diff)              character = base + diff
+    ("sparse", diff)             same, diff stored as a sparse COO tensor
+    ("lowrank", (a, b))          character ~ base + a @ b, lossy, only with --rank
+    ("replace", tensor)          shape differs from the base, e.g. emb_g with other n_speakers
+tensors equal to the base are not stored at all.
+"""
+import os
+import argparse
+import logging
+import threading
+import torch
+
+import utils
+
+logger = logging.getLogger(__name__)
+
+
+def check_same_keys(base_state, state):
+    """
+    Raise ValueError unless both state dicts hold the same tensors. A delta can only express
+    changed values, not modules one model has and the other lacks, e.g. enc_q, which is
+    dropped by prepare_for_inference / export_model.py unless keep_enc_q is set.
+    """
+    only_base = sorted({k.split(".")[0] for k in set(base_state).difference(state)})
+    only_character = sorted({k.split(".")[0] for k in set(state).difference(base_state)})
+    if only_base or only_character:
+        problems = []
+        if only_character:
+            problems.append("the character has {} but the base model does not".format(", ".join(only_character)))
+        if only_base:
+            problems.append("the base model has {} but the character does not".format(", ".join(only_base)))
+        raise ValueError(
+            "base model and character do not have the same modules: {}. Load or export both with the "
+            "same keep_enc_q setting.".format("; ".join(problems))
+        )
+
+
+def compute_delta(base_state, state, rank=None, sparse_density=0.1):
+    check_same_keys(base_state, state)
+    delta = {}
+    for k, v in state.items():
+        base = base_state[k]
+        if base.shape != v.shape:
+            delta[k] = ("replace", v.clone())
+            continue
+        diff = v - base
+        nonzero = int(torch.count_nonzero(diff))
+        if nonzero == 0:
+            continue
+        if nonzero < sparse_density * diff.numel():
+            delta[k] = ("sparse", diff.to_sparse())
+        elif rank is not None and diff.dim() > 1 and rank < min(diff.size(0), diff[0].numel()):
+            u, s, vh = torch.linalg.svd(diff.reshape(diff.size(0), -1).float(), full_matrices=False)
+            a = (u[:, :rank] * s[:rank]).to(diff.dtype)
+            b = vh[:rank].to(diff.dtype)
+            error = torch.linalg.norm(diff.reshape(diff.size(0), -1) - a @ b) / torch.linalg.norm(diff)
+            logger.debug("%s: rank %d, relative error %.4f", k, rank, error)
+            delta[k] = ("lowrank", (a, b))
+        else:
+            delta[k] = ("dense", diff)
+    return delta
+
+
+def apply_delta_entry(base, entry):
+    kind, value = entry
+    if kind == "replace":
+        return value.to(base.device)
+    if kind == "lowrank":
+        a, b = value
+        return base + (a.to(base.device) @ b.to(base.device)).reshape(base.shape)
+    if kind == "sparse":
+        return base + value.to(base.device).to_dense()
+    return base + value.to(base.device)
+
+
+def delta_nbytes(delta):
+    nbytes = 0
+    for kind, value in delta.values():
+        if kind == "sparse":
+            value = [value.indices(), value.values()]
+        elif kind != "lowrank":
+            value = [value]
+        nbytes += sum(t.numel() * t.element_size() for t in value)
+    return nbytes
+
+
+def hparams_to_dict(hps):
+    return {k: hparams_to_dict(v) if isinstance(v, utils.HParams) else v for k, v in hps.items()}
+
+
+def save_delta(path, delta, config):
+    torch.save({"delta": delta, "config": config}, path)
+
+
+def load_delta(path):
+    saved = torch.load(path, map_location="cpu")
+    return saved["delta"], utils.HParams(**saved["config"])
+
+
+class SharedBackbone:
+    """
+    One loaded SynthesizerTrn whose weights are switched between characters.
+    The base weights are kept aside so every switch starts from the exact base values;
+    hold self.lock from select() until inference on the selected character is done.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.base = {k: v.detach().clone() for k, v in model.state_dict().items()}
+        self.active = None
+        self.touched = set()
+        self.lock = threading.RLock()
+
+    def _assign(self, key, value):
+        module_name, _, name = key.rpartition(".")
+        module = self.model.get_submodule(module_name) if module_name else self.model
+        target = getattr(module, name)
+        if target.shape == value.shape:
+            target.data.copy_(value)
+        else:
+            target.data = value.clone()
+
+    @torch.no_grad()
+    def select(self, delta):
+        if delta is self.active:
+            return
+        for k in self.touched.difference(delta):
+            self._assign(k, self.base[k])
+        for k, entry in delta.items():
+            self._assign(k, apply_delta_entry(self.base[k], entry))
+        self.touched = set(delta.keys())
+        self.active = delta
+
+
+class DeltaModel:
+    """Stands in for the SynthesizerTrn of one character, backed by a SharedBackbone"""
+
+    def __init__(self, backbone, delta):
+        self.backbone = backbone
+        self.delta = delta
+
+    def infer(self, *args, **kwargs):
+        with self.backbone.lock:
+            self.backbone.select(self.delta)
+            return self.backbone.model.infer(*args, **kwargs)
+
+    @property
+    def enc_q(self):
+        return self.backbone.model.enc_q
+
+    def voice_conversion(self, *args, **kwargs):
+        with self.backbone.lock:
+            self.backbone.select(self.delta)
+            return self.backbone.model.voice_conversion(*args, **kwargs)
+
+
+def load_character_delta(backbone, model_path, rank=None):
+    """(delta, hps) of a character folder, from OUTPUT_MODEL/delta.pth or computed from its full model"""
+    delta_path = os.path.join(model_path, "OUTPUT_MODEL", "delta.pth")
+    if os.path.exists(delta_path):
+        delta, hps = load_delta(delta_path)
+        unknown = sorted({k.split(".")[0] for k in set(delta).difference(backbone.base)})
+        if unknown:
+            raise ValueError("{} changes {}, which the base model does not have. Recompute it against "
+                             "this base model.".format(delta_path, ", ".join(unknown)))
+        return delta, hps
+    net_g, hps = utils.load_character_model(model_path, "cpu")
+    base_state = {k: v.cpu() for k, v in backbone.base.items()}
+    delta = compute_delta(base_state, net_g.state_dict(), rank=rank)
+    return delta, hps
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-b", "--base_model", type=str, required=True, help="character folder of the base model")
+    parser.add_argument("-m", "--model", type=str, required=True, help="character folder to store as a delta")
+    parser.add_argument("-r", "--rank", type=int, default=None, help="store dense diffs as rank-r products (lossy)")
+    args = parser.parse_args()
+
+    base_g, _ = utils.load_character_model(args.base_model, "cpu")
+    net_g, hps = utils.load_character_model(args.model, "cpu")
+    delta = compute_delta(base_g.state_dict(), net_g.state_dict(), rank=args.rank)
+    output = os.path.join(args.model, "OUTPUT_MODEL", "delta.pth")
+    save_delta(output, delta, hparams_to_dict(hps))
+    full = sum(v.numel() * v.element_size() for v in net_g.state_dict().values())
+    print(f"{output}: {len(delta)} tensors, {delta_nbytes(delta) / 2 ** 20:.1f} MB (full model {full / 2 ** 20:.1f} MB)")
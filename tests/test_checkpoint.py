@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+import torch
+from torch import nn
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils
+from convert_checkpoint import convert_checkpoint
+
+pytest.importorskip("safetensors")
+
+
+@pytest.fixture
+def checkpoints(tmp_path):
+    torch.manual_seed(0)
+    model = nn.Linear(4, 4)
+    optimizer = torch.optim.AdamW(model.parameters())
+    pth = str(tmp_path / "G_1.pth")
+    utils.save_checkpoint(model, optimizer, 2e-4, 1, pth)
+    safetensors = str(tmp_path / "G_1.safetensors")
+    convert_checkpoint(pth, safetensors)
+    return model, pth, safetensors
+
+
+def test_safetensors_round_trip(checkpoints):
+    model, _, safetensors = checkpoints
+    loaded = nn.Linear(4, 4)
+    _, _, learning_rate, iteration = utils.load_checkpoint(safetensors, loaded)
+    assert (learning_rate, iteration) == (2e-4, 1)
+    for k, v in model.state_dict().items():
+        assert torch.equal(loaded.state_dict()[k], v)
+
+
+def test_safetensors_with_optimizer_is_rejected(checkpoints):
+    _, _, safetensors = checkpoints
+    loaded = nn.Linear(4, 4)
+    with pytest.raises(ValueError, match="weights only"):
+        utils.load_checkpoint(safetensors, loaded, torch.optim.AdamW(loaded.parameters()))
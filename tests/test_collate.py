@@ -0,0 +1,31 @@
+import os
+import sys
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from data_utils import TextAudioSpeakerCollate
+
+
+def make_batch(lengths):
+    torch.manual_seed(0)
+    return [
+        (torch.randint(1, 50, (n,)), torch.randn(513, n), torch.randn(1, n * 256), torch.LongTensor([i]))
+        for i, n in enumerate(lengths)
+    ]
+
+
+def test_padded_batch_is_contiguous_and_zero_padded():
+    batch = make_batch([20, 27, 9])
+    text, text_lengths, spec, spec_lengths, wav, wav_lengths, sid = TextAudioSpeakerCollate()(batch)
+
+    assert spec.shape == (3, 513, 27) and wav.shape == (3, 1, 27 * 256)
+    assert spec.is_contiguous() and wav.is_contiguous()
+    assert spec.dtype == wav.dtype == torch.float
+    assert spec_lengths.tolist() == [27, 20, 9]
+    assert sid.tolist() == [1, 0, 2]
+    for row, (t, s, w, _) in enumerate(batch[i] for i in (1, 0, 2)):
+        n = s.size(1)
+        assert torch.equal(text[row, :t.size(0)], t) and not text[row, t.size(0):].any()
+        assert torch.equal(spec[row, :, :n], s) and not spec[row, :, n:].any()
+        assert torch.equal(wav[row, :, :w.size(1)], w) and not wav[row, :, w.size(1):].any()
@@ -0,0 +1,52 @@
+import os
+import sys
+
+import pytest
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import commons
+import monotonic_align
+from monotonic_align import core_py
+
+
+def make_inputs(batch_size, t_s, t_t):
+    # random lengths with t_s <= t_t, as in training where a frame never covers two phonemes
+    x_lengths = torch.randint(t_s // 2, t_s + 1, (batch_size,))
+    y_lengths = torch.randint(t_t // 2, t_t + 1, (batch_size,))
+    x_lengths[0], y_lengths[0] = t_s, t_t
+    y_lengths = torch.maximum(y_lengths, x_lengths)
+    x_mask = commons.sequence_mask(x_lengths, t_s).float()
+    y_mask = commons.sequence_mask(y_lengths, t_t).float()
+    mask = y_mask.unsqueeze(2) * x_mask.unsqueeze(1)  # [b, t_t, t_s]
+    neg_cent = torch.randn(batch_size, t_t, t_s) * 10
+    return neg_cent, mask
+
+
+def reference(neg_cent, mask):
+    # core.pyx when it is built, otherwise the numpy port, which shares no code with numba or torch
+    if monotonic_align.BACKEND == "cython":
+        return monotonic_align.maximum_path(neg_cent, mask)
+    return monotonic_align.maximum_path(neg_cent, mask, core_py.maximum_path_numpy)
+
+
+BACKENDS = {
+    "default": monotonic_align.maximum_path,
+    "numpy": lambda n, m: monotonic_align.maximum_path(n, m, core_py.maximum_path_numpy),
+    "torch": monotonic_align.maximum_path_torch,
+}
+if core_py.maximum_path_numba is not None:
+    BACKENDS["numba"] = lambda n, m: monotonic_align.maximum_path(n, m, core_py.maximum_path_numba)
+
+
+@pytest.mark.parametrize("name", sorted(BACKENDS))
+@pytest.mark.parametrize("batch_size, t_s, t_t", [(1, 1, 1), (1, 50, 200), (8, 50, 200), (4, 100, 400), (3, 30, 30)])
+def test_backends_match_reference(name, batch_size, t_s, t_t):
+    torch.manual_seed(batch_size * 1000 + t_s)
+    neg_cent, mask = make_inputs(batch_size, t_s, t_t)
+    expected = reference(neg_cent, mask)
+    path = BACKENDS[name](neg_cent, mask)
+    assert path.dtype == neg_cent.dtype
+    assert torch.equal(path, expected)
+    # every frame inside the mask is assigned to exactly one phoneme
+    assert torch.equal(path.sum(2), mask[:, :, 0])
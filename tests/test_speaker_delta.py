@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+import torch
+from torch import nn
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from speaker_delta import SharedBackbone, DeltaModel, compute_delta, check_same_keys
+
+
+class TinyModel(nn.Module):
+    def __init__(self, keep_enc_q=True):
+        super().__init__()
+        self.dec = nn.Linear(4, 4)
+        self.enc_q = nn.Linear(4, 4) if keep_enc_q else None
+
+    def infer(self, x):
+        return self.dec(x)
+
+
+def test_delta_round_trip():
+    torch.manual_seed(0)
+    base, character = TinyModel(), TinyModel()
+    delta = compute_delta(base.state_dict(), character.state_dict())
+    backbone = SharedBackbone(base)
+    x = torch.randn(2, 4)
+    assert torch.allclose(DeltaModel(backbone, delta).infer(x), character.infer(x), atol=1e-6)
+
+
+@pytest.mark.parametrize("base_enc_q, character_enc_q", [(False, True), (True, False)])
+def test_mismatched_keys_are_rejected(base_enc_q, character_enc_q):
+    base, character = TinyModel(base_enc_q), TinyModel(character_enc_q)
+    with pytest.raises(ValueError, match="enc_q"):
+        compute_delta(base.state_dict(), character.state_dict())
+    with pytest.raises(ValueError, match="keep_enc_q"):
+        check_same_keys(base.state_dict(), character.state_dict())
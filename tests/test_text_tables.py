@@ -0,0 +1,62 @@
+import importlib
+import os
+import random
+import re
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from text import _encode
+
+TABLES = [
+    ("text.mandarin", "_latin_to_bopomofo"),
+    ("text.mandarin", "_bopomofo_to_romaji"),
+    ("text.mandarin", "_romaji_to_ipa"),
+    ("text.mandarin", "_bopomofo_to_ipa"),
+    ("text.mandarin", "_bopomofo_to_ipa2"),
+    ("text.korean", "_hangul_divided"),
+    ("text.korean", "_latin_to_hangul"),
+    ("text.korean", "_ipa_to_lazy_ipa"),
+    ("text.japanese", "_romaji_to_ipa"),
+    ("text.japanese", "_romaji_to_ipa2"),
+]
+
+
+def sequential(rules, text):
+    for regex, replacement in rules:
+        text = re.sub(regex, replacement, text)
+    return text
+
+
+@pytest.mark.parametrize("module_name, name", TABLES)
+def test_rule_table_matches_sequential_subs(module_name, name):
+    try:
+        module = importlib.import_module(module_name)
+    except ImportError as e:
+        pytest.skip(str(e))
+    rules = getattr(module, name)
+    table = getattr(module, name + "_table")
+    # strings over everything the rules match or produce, the cases where merging could go wrong
+    alphabet = sorted({c for regex, replacement in rules for c in regex.pattern + replacement} | set(" ,.↑↓"))
+    rng = random.Random(1234)
+    for _ in range(2000):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        assert table(text) == sequential(rules, text), text
+
+
+def legacy_encode(clean_text, symbols):
+    # the symbol lookup before the table was cached
+    symbol_to_id = {s: i for i, s in enumerate(symbols)}
+    return [symbol_to_id[symbol] for symbol in clean_text if symbol in symbol_to_id.keys()]
+
+
+@pytest.mark.parametrize("n_symbols", [40, 256, 300])
+def test_encode_matches_dict_lookup(n_symbols):
+    # past 256 symbols ids no longer fit in one byte and _encode takes its other path
+    symbols = ["_", "…"] + [chr(0x100 + i) for i in range(n_symbols - 3)] + ["ts"]
+    rng = random.Random(n_symbols)
+    alphabet = [s for s in symbols if len(s) == 1] + list("ts ,.?!ab\n")
+    for _ in range(500):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 60)))
+        assert _encode(text, symbols) == legacy_encode(text, symbols)
@@ -2,8 +2,12 @@
 
 from text import cleaners
 from text.symbols import symbols
+from text.cache import CleanerCache, cache_key
+import functools
 import logging
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor
 
 logger = logging.getLogger("text")
 
@@ -11,10 +15,41 @@ logger = logging.getLogger("text")
 _symbol_to_id = {s: i for i, s in enumerate(symbols)}
 _id_to_symbol = {i: s for i, s in enumerate(symbols)}
 
+# see enable_cache
+_cache = None
+
+
+class _SymbolTable(dict):
+    """str.translate table mapping each symbol to chr(id) and dropping unknown characters"""
+
+    def __missing__(self, key):
+        return None
+
+
+@functools.lru_cache(maxsize=None)
+def _symbol_table(symbols):
+    return _SymbolTable({ord(s): chr(i) for i, s in enumerate(symbols) if len(s) == 1})
+
+
+def _encode(clean_text, symbols):
+    symbols = tuple(symbols)
+    ids = clean_text.translate(_symbol_table(symbols))
+    if len(symbols) <= 256:
+        # every id fits in one byte, so latin-1 turns the ids into ints in C
+        return list(ids.encode("latin-1"))
+    return list(map(ord, ids))
+
+
+def enable_cache(path=None, max_entries=10000):
+    """Cache cleaned texts in memory, and in the sqlite file at path if given, see text.cache.CleanerCache.
+    Returns the cache, whose stats() tell how often it hit."""
+    global _cache
+    _cache = CleanerCache(path, max_entries)
+    return _cache
+
 
 def text_to_clean_text(text, cleaner_names) -> str:
-    symbol_to_id = {s: i for i, s in enumerate(symbols)}
-    clean_text = _clean_text(text, cleaner_names)
+    clean_text = _cached_clean_text(text, cleaner_names)
     return clean_text
 
 
@@ -26,21 +61,15 @@ def text_to_sequence(text, symbols, cleaner_names):
     Returns:
       List of integers corresponding to the symbols in the text
     """
-    sequence = []
-    symbol_to_id = {s: i for i, s in enumerate(symbols)}
-
     if "<raw>" in text:
         clean_text = text[9:-4]
     else:
-        clean_text = _clean_text(text, cleaner_names)
-    logger.info(clean_text)
-    logger.info(f" length:{len(clean_text)}")
-    for symbol in clean_text:
-        if symbol not in symbol_to_id.keys():
-            continue
-        symbol_id = symbol_to_id[symbol]
-        sequence += [symbol_id]
-    logger.info(f" length:{len(sequence)}")
+        clean_text = _cached_clean_text(text, cleaner_names)
+    sequence = _encode(clean_text, symbols)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(clean_text)
+        logger.debug(f" length:{len(clean_text)}")
+        logger.debug(f" length:{len(sequence)}")
     return sequence
 
 
@@ -51,11 +80,7 @@ def cleaned_text_to_sequence(cleaned_text, symbols):
     Returns:
       List of integers corresponding to the symbols in the text
     """
-    symbol_to_id = {s: i for i, s in enumerate(symbols)}
-    sequence = [
-        symbol_to_id[symbol] for symbol in cleaned_text if symbol in symbol_to_id.keys()
-    ]
-    return sequence
+    return _encode(cleaned_text, symbols)
 
 
 def sequence_to_text(sequence):
@@ -67,6 +92,50 @@ def sequence_to_text(sequence):
     return result
 
 
+def clean_texts(texts, cleaner_names, num_workers=None):
+    """_clean_text of many texts on a pool of processes, in order.
+    Each worker loads the language backends once and cleans chunks of texts, which is what
+    makes the per-utterance frontends (pyopenjtalk above all) scale with the cores.
+    """
+    if _cache is not None:
+        # only texts the cache has not seen go to the workers
+        keys = [cache_key(text, cleaner_names) for text in texts]
+        cached = _cache.get_many(keys)
+        missing = {key: text for key, text in zip(keys, texts) if key not in cached}
+        cleaned = _clean_texts(list(missing.values()), cleaner_names, num_workers)
+        _cache.put_many(list(zip(missing.keys(), cleaned)))
+        cached.update(zip(missing.keys(), cleaned))
+        return [cached[key] for key in keys]
+    return _clean_texts(texts, cleaner_names, num_workers)
+
+
+def _clean_texts(texts, cleaner_names, num_workers):
+    num_workers = num_workers or os.cpu_count()
+    if num_workers <= 1 or len(texts) < 2:
+        return [_clean_text(text, cleaner_names) for text in texts]
+    chunksize = max(1, len(texts) // (num_workers * 4))
+    with ProcessPoolExecutor(num_workers) as executor:
+        return list(executor.map(functools.partial(_clean_text, cleaner_names=cleaner_names), texts, chunksize=chunksize))
+
+
+def initialize(cleaner_names, jieba_cache=None):
+    """Loads the language data cleaner_names need up front, so the first sentence does not pay for it"""
+    if any(name in cleaners.mandarin_cleaners for name in cleaner_names):
+        from text import mandarin
+        mandarin.initialize(jieba_cache)
+
+
+def _cached_clean_text(text, cleaner_names):
+    if _cache is None:
+        return _clean_text(text, cleaner_names)
+    key = cache_key(text, cleaner_names)
+    clean_text = _cache.get_many([key]).get(key)
+    if clean_text is None:
+        clean_text = _clean_text(text, cleaner_names)
+        _cache.put_many([(key, clean_text)])
+    return clean_text
+
+
 def _clean_text(text, cleaner_names):
     for name in cleaner_names:
         cleaner = getattr(cleaners, name)
@@ -0,0 +1,98 @@
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+# Part of every cache key, bump it whenever a change to the cleaners changes their output
+FRONTEND_VERSION = 1
+
+
+def cache_key(text, cleaner_names):
+    return hashlib.sha1(json.dumps([list(cleaner_names), FRONTEND_VERSION, text], ensure_ascii=False)
+                        .encode('utf-8')).hexdigest()
+
+
+class CleanerCache:
+    '''
+    Content-addressed cache of cleaned texts, keyed by (cleaner names, FRONTEND_VERSION, text).
+    An in-memory LRU of max_entries sits in front of an optional sqlite file at path, which is
+    opened in WAL mode so any number of processes (DataLoader workers, servers, preprocessing)
+    can read it while one of them writes. Every process and thread opens its own connection.
+    '''
+
+    def __init__(self, path=None, max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _connection(self):
+        # a connection must not cross a fork, nor be shared between threads
+        if getattr(self.local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=60)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS cleaned (key TEXT PRIMARY KEY, text TEXT NOT NULL)')
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    def _remember(self, key, value):
+        # called with self.lock held
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def get_many(self, keys):
+        '''{key: cleaned text} of the keys that are cached'''
+        found = {}
+        with self.lock:
+            for key in keys:
+                if key in self.memory:
+                    self.memory.move_to_end(key)
+                    found[key] = self.memory[key]
+            self.memory_hits += len(found)
+        missing = [key for key in keys if key not in found]
+        if missing and self.path is not None:
+            connection = self._connection()
+            from_disk = {}
+            # sqlite limits the number of parameters of one statement
+            for i in range(0, len(missing), 500):
+                batch = missing[i:i + 500]
+                from_disk.update(connection.execute(
+                    'SELECT key, text FROM cleaned WHERE key IN (%s)' % ','.join('?' * len(batch)), batch))
+            with self.lock:
+                for key, value in from_disk.items():
+                    self._remember(key, value)
+                self.disk_hits += len(from_disk)
+            found.update(from_disk)
+        with self.lock:
+            self.misses += len(set(keys).difference(found))
+        return found
+
+    def put_many(self, items):
+        with self.lock:
+            for key, value in items:
+                self._remember(key, value)
+        if self.path is not None and items:
+            connection = self._connection()
+            with connection:
+                connection.executemany('INSERT OR REPLACE INTO cleaned (key, text) VALUES (?, ?)', items)
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            'entries_in_memory': len(self.memory),
+        }
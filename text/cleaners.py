@@ -1,10 +1,50 @@
 import re
-from text.japanese import japanese_to_romaji_with_accent, japanese_to_ipa, japanese_to_ipa2, japanese_to_ipa3
-from text.korean import latin_to_hangul, number_to_hangul, divide_hangul, korean_to_lazy_ipa, korean_to_ipa
-from text.mandarin import number_to_chinese, chinese_to_bopomofo, latin_to_bopomofo, chinese_to_romaji, chinese_to_lazy_ipa, chinese_to_ipa, chinese_to_ipa2
-from text.sanskrit import devanagari_to_ipa
-from text.english import english_to_lazy_ipa, english_to_ipa2, english_to_lazy_ipa2
-from text.thai import num_to_thai, latin_to_thai
+import importlib
+
+
+def _lazy(module, name):
+    '''
+    Stands in for text.<module>.<name> and imports that module, with its language backend
+    (pyopenjtalk, jieba, ...), the first time it is called, i.e. when text in that language
+    is first cleaned.
+    '''
+    func = None
+
+    def wrapper(*args, **kwargs):
+        nonlocal func
+        if func is None:
+            func = getattr(importlib.import_module('text.' + module), name)
+        return func(*args, **kwargs)
+
+    wrapper.__name__ = name
+    return wrapper
+
+
+japanese_to_romaji_with_accent = _lazy('japanese', 'japanese_to_romaji_with_accent')
+japanese_to_ipa = _lazy('japanese', 'japanese_to_ipa')
+japanese_to_ipa2 = _lazy('japanese', 'japanese_to_ipa2')
+japanese_to_ipa3 = _lazy('japanese', 'japanese_to_ipa3')
+latin_to_hangul = _lazy('korean', 'latin_to_hangul')
+number_to_hangul = _lazy('korean', 'number_to_hangul')
+divide_hangul = _lazy('korean', 'divide_hangul')
+korean_to_lazy_ipa = _lazy('korean', 'korean_to_lazy_ipa')
+korean_to_ipa = _lazy('korean', 'korean_to_ipa')
+number_to_chinese = _lazy('mandarin', 'number_to_chinese')
+chinese_to_bopomofo = _lazy('mandarin', 'chinese_to_bopomofo')
+latin_to_bopomofo = _lazy('mandarin', 'latin_to_bopomofo')
+chinese_to_romaji = _lazy('mandarin', 'chinese_to_romaji')
+chinese_to_lazy_ipa = _lazy('mandarin', 'chinese_to_lazy_ipa')
+chinese_to_ipa = _lazy('mandarin', 'chinese_to_ipa')
+chinese_to_ipa2 = _lazy('mandarin', 'chinese_to_ipa2')
+devanagari_to_ipa = _lazy('sanskrit', 'devanagari_to_ipa')
+english_to_lazy_ipa = _lazy('english', 'english_to_lazy_ipa')
+english_to_ipa2 = _lazy('english', 'english_to_ipa2')
+english_to_lazy_ipa2 = _lazy('english', 'english_to_lazy_ipa2')
+num_to_thai = _lazy('thai', 'num_to_thai')
+latin_to_thai = _lazy('thai', 'latin_to_thai')
+
+# cleaners that run text through text.mandarin
+mandarin_cleaners = {'chinese_cleaners', 'zh_ja_mixture_cleaners', 'cjks_cleaners', 'cjke_cleaners', 'cjke_cleaners2'}
 # from text.shanghainese import shanghainese_to_ipa
 # from text.cantonese import cantonese_to_ipa
 # from text.ngu_dialect import ngu_dialect_to_ipa
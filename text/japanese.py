@@ -1,6 +1,7 @@
 import re
 from unidecode import unidecode
 import pyopenjtalk
+from text.rules import RuleTable
 
 
 # Regular expression matching Japanese without punctuation marks:
@@ -11,6 +12,9 @@ _japanese_characters = re.compile(
 _japanese_marks = re.compile(
     r'[^A-Za-z\d\u3005\u3040-\u30ff\u4e00-\u9fff\uff11-\uff19\uff21-\uff3a\uff41-\uff5a\uff66-\uff9d]')
 
+# Regular expression matching the phoneme and the A:a1+a2+a3 accent fields of a full-context label:
+_label_fields = re.compile(r'\-([^\+]*)\+.*?/A:(\-?[0-9]+|xx)\+([0-9]+|xx)\+([0-9]+|xx)/')
+
 # List of (symbol, Japanese) pairs for marks:
 _symbols_to_japanese = [(re.compile('%s' % x[0]), x[1]) for x in [
     ('％', 'パーセント')
@@ -64,6 +68,10 @@ _real_hatsuon = [(re.compile('%s' % x[0]), x[1]) for x in [
     (r'N([↑↓]*[kg])', r'ŋ\1')
 ]]
 
+# The tables above applied in as few passes as possible, see text.rules
+_romaji_to_ipa_table = RuleTable(_romaji_to_ipa)
+_romaji_to_ipa2_table = RuleTable(_romaji_to_ipa2)
+
 
 def symbols_to_japanese(text):
     for regex, replacement in _symbols_to_japanese:
@@ -71,6 +79,40 @@ def symbols_to_japanese(text):
     return text
 
 
+def parse_labels(labels):
+    '''
+    Parse full-context labels once into (phoneme, a1, a2, a3) tuples,
+    pauses get a2 = -1 so they never continue an accent phrase.
+    '''
+    fields = []
+    for label in labels:
+        phoneme, a1, a2, a3 = _label_fields.search(label).groups()
+        if phoneme in ('sil', 'pau'):
+            fields.append((phoneme, 0, -1, 0))
+        else:
+            fields.append((phoneme, int(a1), int(a2), int(a3)))
+    return fields
+
+
+def labels_to_romaji_with_accent(fields):
+    text = ''
+    for n, (phoneme, a1, a2, a3) in enumerate(fields):
+        if phoneme in ('sil', 'pau'):
+            continue
+        text += phoneme.replace('ch', 'ʧ').replace('sh', 'ʃ').replace('cl', 'Q')
+        a2_next = fields[n + 1][2]
+        # Accent phrase boundary
+        if a3 == 1 and a2_next == 1:
+            text += ' '
+        # Falling
+        elif a1 == 0 and a2_next == a2 + 1:
+            text += '↓'
+        # Rising
+        elif a2 == 1 and a2_next == 2:
+            text += '↑'
+    return text
+
+
 def japanese_to_romaji_with_accent(text):
     '''Reference https://r9y9.github.io/ttslearn/latest/notebooks/ch10_Recipe-Tacotron.html'''
     text = symbols_to_japanese(text)
@@ -82,31 +124,7 @@ def japanese_to_romaji_with_accent(text):
             if text != '':
                 text += ' '
             labels = pyopenjtalk.extract_fullcontext(sentence)
-            for n, label in enumerate(labels):
-                phoneme = re.search(r'\-([^\+]*)\+', label).group(1)
-                if phoneme not in ['sil', 'pau']:
-                    text += phoneme.replace('ch', 'ʧ').replace('sh',
-                                                               'ʃ').replace('cl', 'Q')
-                else:
-                    continue
-                # n_moras = int(re.search(r'/F:(\d+)_', label).group(1))
-                a1 = int(re.search(r"/A:(\-?[0-9]+)\+", label).group(1))
-                a2 = int(re.search(r"\+(\d+)\+", label).group(1))
-                a3 = int(re.search(r"\+(\d+)/", label).group(1))
-                if re.search(r'\-([^\+]*)\+', labels[n + 1]).group(1) in ['sil', 'pau']:
-                    a2_next = -1
-                else:
-                    a2_next = int(
-                        re.search(r"\+(\d+)\+", labels[n + 1]).group(1))
-                # Accent phrase boundary
-                if a3 == 1 and a2_next == 1:
-                    text += ' '
-                # Falling
-                elif a1 == 0 and a2_next == a2 + 1:
-                    text += '↓'
-                # Rising
-                elif a2 == 1 and a2_next == 2:
-                    text += '↑'
+            text += labels_to_romaji_with_accent(parse_labels(labels))
         if i < len(marks):
             text += unidecode(marks[i]).replace(' ', '')
     return text
@@ -130,8 +148,7 @@ def japanese_to_ipa(text):
         r'([aiueo])\1+', lambda x: x.group(0)[0]+'ː'*(len(x.group(0))-1), text)
     text = get_real_sokuon(text)
     text = get_real_hatsuon(text)
-    for regex, replacement in _romaji_to_ipa:
-        text = re.sub(regex, replacement, text)
+    text = _romaji_to_ipa_table(text)
     return text
 
 
@@ -139,8 +156,7 @@ def japanese_to_ipa2(text):
     text = japanese_to_romaji_with_accent(text).replace('...', '…')
     text = get_real_sokuon(text)
     text = get_real_hatsuon(text)
-    for regex, replacement in _romaji_to_ipa2:
-        text = re.sub(regex, replacement, text)
+    text = _romaji_to_ipa2_table(text)
     return text
 
 
@@ -1,6 +1,7 @@
 import re
 from jamo import h2j, j2hcj
 import ko_pron
+from text.rules import RuleTable
 
 
 # This is a list of Korean classifiers preceded by pure Korean numerals.
@@ -85,17 +86,20 @@ _ipa_to_lazy_ipa = [(re.compile('%s' % x[0], re.IGNORECASE), x[1]) for x in [
     ('\u0339','')
 ]]
 
+# The tables above applied in as few passes as possible, see text.rules
+_hangul_divided_table = RuleTable(_hangul_divided)
+_latin_to_hangul_table = RuleTable(_latin_to_hangul)
+_ipa_to_lazy_ipa_table = RuleTable(_ipa_to_lazy_ipa)
+
 
 def latin_to_hangul(text):
-    for regex, replacement in _latin_to_hangul:
-        text = re.sub(regex, replacement, text)
+    text = _latin_to_hangul_table(text)
     return text
 
 
 def divide_hangul(text):
     text = j2hcj(h2j(text))
-    for regex, replacement in _hangul_divided:
-        text = re.sub(regex, replacement, text)
+    text = _hangul_divided_table(text)
     return text
 
 
@@ -200,8 +204,7 @@ def korean_to_lazy_ipa(text):
     text = latin_to_hangul(text)
     text = number_to_hangul(text)
     text=re.sub('[\uac00-\ud7af]+',lambda x:ko_pron.romanise(x.group(0),'ipa').split('] ~ [')[0],text)
-    for regex, replacement in _ipa_to_lazy_ipa:
-        text = re.sub(regex, replacement, text)
+    text = _ipa_to_lazy_ipa_table(text)
     return text
 
 
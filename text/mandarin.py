@@ -5,6 +5,7 @@ from pypinyin import lazy_pinyin, BOPOMOFO
 import jieba
 import cn2an
 import logging
+from text.rules import RuleTable
 
 
 # List of (Latin alphabet, bopomofo) pairs:
@@ -232,6 +233,32 @@ _bopomofo_to_ipa2 = [(re.compile('%s' % x[0]), x[1]) for x in [
     ('—', '-')
 ]]
 
+# The tables above applied in as few passes as possible, see text.rules
+_latin_to_bopomofo_table = RuleTable(_latin_to_bopomofo)
+_bopomofo_to_romaji_table = RuleTable(_bopomofo_to_romaji)
+_romaji_to_ipa_table = RuleTable(_romaji_to_ipa)
+_bopomofo_to_ipa_table = RuleTable(_bopomofo_to_ipa)
+_bopomofo_to_ipa2_table = RuleTable(_bopomofo_to_ipa2)
+
+
+_initialized = False
+
+
+def initialize(cache_file=None):
+    '''
+    Load the jieba dictionary and the pypinyin data now, instead of stalling on the first sentence.
+    cache_file: jieba's serialized prefix dictionary, built on the first run and loaded from then on
+    (jieba's default is a file in the temp dir)
+    '''
+    global _initialized
+    if _initialized:
+        return
+    if cache_file is not None:
+        jieba.dt.cache_file = cache_file
+    jieba.initialize()
+    lazy_pinyin('中文', BOPOMOFO)
+    _initialized = True
+
 
 def number_to_chinese(text):
     numbers = re.findall(r'\d+(?:\.?\d+)?', text)
@@ -258,26 +285,22 @@ def chinese_to_bopomofo(text):
 
 
 def latin_to_bopomofo(text):
-    for regex, replacement in _latin_to_bopomofo:
-        text = re.sub(regex, replacement, text)
+    text = _latin_to_bopomofo_table(text)
     return text
 
 
 def bopomofo_to_romaji(text):
-    for regex, replacement in _bopomofo_to_romaji:
-        text = re.sub(regex, replacement, text)
+    text = _bopomofo_to_romaji_table(text)
     return text
 
 
 def bopomofo_to_ipa(text):
-    for regex, replacement in _bopomofo_to_ipa:
-        text = re.sub(regex, replacement, text)
+    text = _bopomofo_to_ipa_table(text)
     return text
 
 
 def bopomofo_to_ipa2(text):
-    for regex, replacement in _bopomofo_to_ipa2:
-        text = re.sub(regex, replacement, text)
+    text = _bopomofo_to_ipa2_table(text)
     return text
 
 
@@ -296,8 +319,7 @@ def chinese_to_romaji(text):
 
 def chinese_to_lazy_ipa(text):
     text = chinese_to_romaji(text)
-    for regex, replacement in _romaji_to_ipa:
-        text = re.sub(regex, replacement, text)
+    text = _romaji_to_ipa_table(text)
     return text
 
 
@@ -0,0 +1,89 @@
+import re
+
+
+_regex_special = set('.^$*+?{}[]\\|()')
+
+
+def _is_literal(pattern):
+    return not any(c in _regex_special for c in pattern)
+
+
+def _chars(s, ignorecase):
+    if not ignorecase:
+        return set(s)
+    return {v for c in s for v in (c, c.lower(), c.upper(), c.casefold())}
+
+
+def _same(a, b, ignorecase):
+    return a.casefold() == b.casefold() if ignorecase else a == b
+
+
+def _conflicts(earlier, later, ignorecase):
+    '''
+    Whether applying `later` in the same pass as `earlier` could differ from applying it afterwards.
+    '''
+    pattern, replacement = earlier
+    later_pattern = later[0]
+    # chaining: the later rule could match text the earlier one produced
+    if _chars(later_pattern, ignorecase) & _chars(replacement, ignorecase):
+        return True
+    # deleting text joins its neighbours, which a longer pattern could then match
+    if replacement == '' and len(later_pattern) > 1:
+        return True
+    # the later rule could match starting before, and overlapping, a match of the earlier one,
+    # sequentially the earlier rule would have taken those characters first
+    for k in range(1, len(later_pattern)):
+        n = min(len(later_pattern) - k, len(pattern))
+        if _same(later_pattern[k:k + n], pattern[:n], ignorecase):
+            return True
+    return False
+
+
+class RuleTable:
+    '''
+    An ordered list of (regex, replacement) substitutions, as applied one after another with re.sub,
+    compiled into as few passes as possible with the same output.
+    Consecutive literal rules that can not interact are merged into one alternation of capturing
+    groups in rule order, so at every position the first rule in the list wins like it would when
+    applied sequentially. Passes with only single characters and no flags become str.translate.
+    '''
+
+    def __init__(self, rules):
+        self.stages = []
+        group = []
+        for regex, replacement in rules:
+            mergeable = _is_literal(regex.pattern) and '\\' not in replacement
+            if group and (not mergeable or regex.flags != group[0][0].flags or any(
+                    _conflicts((r.pattern, s), (regex.pattern, replacement), bool(regex.flags & re.IGNORECASE))
+                    for r, s in group)):
+                self.stages.append(self._compile(group))
+                group = []
+            if mergeable:
+                group.append((regex, replacement))
+            else:
+                self.stages.append((regex, replacement))
+        if group:
+            self.stages.append(self._compile(group))
+
+    @staticmethod
+    def _compile(group):
+        if len(group) == 1:
+            return group[0]
+        flags = group[0][0].flags
+        if all(len(r.pattern) == 1 for r, _ in group) and not flags & re.IGNORECASE:
+            table = {}
+            for r, s in group:
+                # a repeated pattern never matches again once the first rule replaced it
+                table.setdefault(ord(r.pattern), s)
+            return table
+        regex = re.compile('|'.join('(%s)' % r.pattern for r, _ in group), flags)
+        replacements = [s for _, s in group]
+        return (regex, lambda m: replacements[m.lastindex - 1])
+
+    def __call__(self, text):
+        for stage in self.stages:
+            if isinstance(stage, dict):
+                text = text.translate(stage)
+            else:
+                text = re.sub(stage[0], stage[1], text)
+        return text
@@ -1,6 +1,7 @@
 import os
 import glob
 import sys
+import struct
 import argparse
 import logging
 import json
@@ -10,6 +11,9 @@ from scipy.io.wavfile import read
 import torch
 import regex as re
 
+import commons
+from text import text_to_sequence
+
 MATPLOTLIB_FLAG = False
 logger = logging.getLogger(__name__)
 
@@ -21,15 +25,34 @@ kr_pattern = re.compile(r"[\uac00-\ud7af\u1100-\u11ff\u3130-\u318f\ua960-\ua97f]
 num_pattern = re.compile(r"[0-9]")
 comma = r"(?<=[.。!！?？；;，,、:：'\"‘“”’()（）《》「」~——])"  # 向前匹配但固定长度
 tags = {"ZH": "[ZH]", "EN": "[EN]", "JP": "[JA]", "KR": "[KR]"}
+sentence_split_pattern = re.compile(
+    r"([.。!！?？；;，,、:：'\"‘“”’()（）【】《》「」~——]+ *(?![0-9]))"
+)  # 分句，排除小数点
 
 
-def tag_cjke(text):
-    """为中英日韩加tag,中日正则分不开，故先分句分离中日再识别，以应对大部分情况"""
-    sentences = re.split(
-        r"([.。!！?？；;，,、:：'\"‘“”’()（）【】《》「」~——]+ *(?![0-9]))", text
-    )  # 分句，排除小数点
+def split_sentences(text, max_len=None):
+    """按标点分句，标点保留在句尾
+    max_len: 若指定，则把相邻短句合并，使每段不超过 max_len 个字符
+    """
+    sentences = sentence_split_pattern.split(text)
     sentences.append("")
     sentences = ["".join(i) for i in zip(sentences[0::2], sentences[1::2])]
+    if max_len is None:
+        return sentences
+    merged = []
+    for s in sentences:
+        if len(re.sub(r"[\s\p{P}]+", "", s, flags=re.U)) == 0 and merged:
+            merged[-1] += s
+        elif merged and len(merged[-1]) + len(s) <= max_len:
+            merged[-1] += s
+        else:
+            merged.append(s)
+    return [s for s in merged if s.strip()]
+
+
+def tag_cjke(text):
+    """为中英日韩加tag,中日正则分不开，故先分句分离中日再识别，以应对大部分情况"""
+    sentences = split_sentences(text)
     # print(sentences)
     prev_lang = None
     tagged_text = ""
@@ -146,9 +169,85 @@ def tag_cke(text, prev_sentence=None):
     return prev_lang, tagged_text
 
 
-def load_checkpoint(checkpoint_path, model, optimizer=None, drop_speaker_emb=False):
+language_marks = {
+    "Japanese": "",
+    "日本語": "[JA]",
+    "简体中文": "[ZH]",
+    "English": "[EN]",
+    "Mix": "",
+}
+
+
+def get_text(text, hps, is_symbol):
+    text_norm = text_to_sequence(text, hps.symbols, [] if is_symbol else hps.data.text_cleaners)
+    if hps.data.add_blank:
+        text_norm = commons.intersperse(text_norm, 0)
+    text_norm = torch.LongTensor(text_norm)
+    return text_norm
+
+
+def split_long_text(text, language, max_len=100):
+    """按标点切分长文本，并为每一句加上语言标记"""
+    marks = language_marks[language] if language is not None else ""
+    if marks:
+        return [marks + s + marks for s in split_sentences(text, max_len)]
+    # Mix 模式下文本已自带 [ZH]...[ZH] 等标记，需在每段标记内部分句
+    # 标记之外的文本原样保留（与不分句时一样直接交给 cleaner）
+    sentences = []
+    pos = 0
+    for m in re.finditer(r"(\[[A-Z]{2}\])(.*?)\1", text):
+        sentences += split_sentences(text[pos:m.start()], max_len)
+        tag = m.group(1)
+        sentences += [tag + s + tag for s in split_sentences(m.group(2), max_len)]
+        pos = m.end()
+    sentences += split_sentences(text[pos:], max_len)
+    return sentences
+
+
+def torch_load_mmap(checkpoint_path):
+    """
+    torch.load(map_location="cpu") that memory-maps the file where possible (torch >= 2.1 and
+    the zipfile format), so tensors are paged in on use instead of read and copied up front
+    """
+    try:
+        return torch.load(checkpoint_path, map_location="cpu", mmap=True)
+    except (TypeError, RuntimeError):
+        # older torch has no mmap argument, legacy (pre 1.6) files can not be mapped
+        return torch.load(checkpoint_path, map_location="cpu")
+
+
+def load_safetensors_checkpoint(checkpoint_path):
+    """Read a checkpoint written by convert_checkpoint.py, optimizer state is not stored"""
+    try:
+        from safetensors import safe_open
+    except ImportError:
+        raise ImportError("pip install safetensors to load {}".format(checkpoint_path))
+    with safe_open(checkpoint_path, framework="pt", device="cpu") as f:
+        metadata = f.metadata() or {}
+        state_dict = {k: f.get_tensor(k) for k in f.keys()}
+    return {
+        "model": state_dict,
+        "iteration": int(metadata.get("iteration", 0)),
+        "learning_rate": float(metadata.get("learning_rate", 0.0)),
+        "optimizer": None,
+    }
+
+
+def load_checkpoint(checkpoint_path, model, optimizer=None, drop_speaker_emb=False, assign=False):
+    """
+    assign=True (torch >= 2.1) makes the loaded tensors the model parameters instead of copying
+    them in, only use it for models on the CPU in the checkpoint dtype, e.g. for inference.
+    """
     assert os.path.isfile(checkpoint_path)
-    checkpoint_dict = torch.load(checkpoint_path, map_location="cpu")
+    if checkpoint_path.endswith(".safetensors"):
+        if optimizer is not None:
+            raise ValueError(
+                "{} holds model weights only, resume training from the .pth checkpoint "
+                "or load it without an optimizer".format(checkpoint_path)
+            )
+        checkpoint_dict = load_safetensors_checkpoint(checkpoint_path)
+    else:
+        checkpoint_dict = torch_load_mmap(checkpoint_path)
     iteration = checkpoint_dict["iteration"]
     learning_rate = checkpoint_dict["learning_rate"]
     if optimizer is not None:
@@ -172,16 +271,76 @@ def load_checkpoint(checkpoint_path, model, optimizer=None, drop_speaker_emb=Fal
         except:
             logger.info("%s is not in the checkpoint" % k)
             new_state_dict[k] = v
-    if hasattr(model, "module"):
-        model.module.load_state_dict(new_state_dict)
-    else:
-        model.load_state_dict(new_state_dict)
+    module = model.module if hasattr(model, "module") else model
+    try:
+        module.load_state_dict(new_state_dict, assign=assign)
+    except TypeError:
+        # torch < 2.1
+        module.load_state_dict(new_state_dict)
     logger.info(
         "Loaded checkpoint '{}' (iteration {})".format(checkpoint_path, iteration)
     )
     return model, optimizer, learning_rate, iteration
 
 
+def load_inference_model(artifact_path, device="cpu"):
+    """
+    Load an artifact written by export_model.py, returns (net_g, hps).
+    The model is built from the embedded config, weights are loaded as float32.
+    """
+    from models import SynthesizerTrn
+
+    artifact = torch_load_mmap(artifact_path)
+    hps = HParams(**artifact["config"])
+    net_g = SynthesizerTrn(
+        len(hps.symbols),
+        hps.data.filter_length // 2 + 1,
+        hps.train.segment_size // hps.data.hop_length,
+        n_speakers=hps.data.n_speakers,
+        **hps.model,
+    )
+    net_g.prepare_for_inference(keep_enc_q=artifact["keep_enc_q"])
+    net_g.load_state_dict(artifact["model"])
+    logger.info(
+        "Loaded inference model '{}' ({} weights)".format(artifact_path, artifact["dtype"])
+    )
+    return net_g.to(device), hps
+
+
+def load_character_model(model_path, device="cpu"):
+    """
+    Load a character folder as used by VC_inference, returns (net_g, hps) ready for inference.
+    OUTPUT_MODEL/G_infer.pth from export_model.py is preferred, otherwise
+    OUTPUT_MODEL/G_latest.pth and finetune_speaker.json are loaded and enc_q is kept for voice conversion.
+    """
+    from models import SynthesizerTrn
+
+    model_infer = os.path.join(model_path, "OUTPUT_MODEL", "G_infer.pth")
+    if os.path.exists(model_infer):
+        # exported by export_model.py, config is embedded
+        net_g, hps = load_inference_model(model_infer, device)
+        if net_g.enc_q is None:
+            logger.warning(
+                "{} was exported with --keep_enc_q false, voice conversion is unavailable".format(model_infer)
+            )
+        return net_g, hps
+
+    model_g = os.path.join(model_path, "OUTPUT_MODEL", "G_latest.pth")
+    hps = get_hparams_from_file(os.path.join(model_path, "finetune_speaker.json"))
+    net_g = SynthesizerTrn(
+        len(hps.symbols),
+        hps.data.filter_length // 2 + 1,
+        hps.train.segment_size // hps.data.hop_length,
+        n_speakers=hps.data.n_speakers,
+        **hps.model,
+    ).to(device)
+    _ = net_g.eval()
+    # on the CPU, take the memory-mapped tensors over without a copy
+    _ = load_checkpoint(model_g, net_g, None, assign=device == "cpu")
+    net_g.prepare_for_inference(keep_enc_q=True)
+    return net_g, hps
+
+
 def save_checkpoint(model, optimizer, learning_rate, iteration, checkpoint_path):
     logger.info(
         "Saving model and optimizer state at iteration {} to {}".format(
@@ -307,6 +466,31 @@ def load_wav_to_torch(full_path):
     return torch.FloatTensor(data.astype(np.float32)), sampling_rate
 
 
+def wav_header(sampling_rate, num_samples=None):
+    """
+    44-byte header of a 16-bit mono wav. Without num_samples the RIFF and data sizes are
+    0xFFFFFFFF, which players treat as "read until the end", so samples can be streamed after it.
+    """
+    data_size = 0xFFFFFFFF if num_samples is None else num_samples * 2
+    riff_size = 0xFFFFFFFF if num_samples is None else data_size + 36
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", riff_size, b"WAVE",
+        b"fmt ", 16, 1, 1, sampling_rate, sampling_rate * 2, 2, 16,
+        b"data", data_size,
+    )
+
+
+def pcm16(audio):
+    """int16 samples of a float waveform in [-1, 1]"""
+    return np.clip(audio * 32767, -32768, 32767).astype(np.int16).tobytes()
+
+
+def wav_bytes(audio, sampling_rate):
+    """Contents of a 16-bit mono wav file holding a float waveform in [-1, 1]"""
+    return wav_header(sampling_rate, len(audio)) + pcm16(audio)
+
+
 def load_filepaths_and_text(filename, split="|"):
     with open(filename, encoding="utf-8") as f:
         filepaths_and_text = [line.strip().split(split) for line in f]
@@ -360,6 +544,13 @@ def get_hparams(init=True):
     parser.add_argument(
         "--preserved", type=int, default=4, help="Number of preserved models"
     )
+    parser.add_argument(
+        "--rebuild_cache",
+        "--rebuild-cache",
+        type=str2bool,
+        default=False,
+        help="whether to discard cached spectrograms and recompute them",
+    )
 
     args = parser.parse_args()
     model_dir = os.path.join("./", args.model)
@@ -386,6 +577,7 @@ def get_hparams(init=True):
     hparams.drop_speaker_embed = args.drop_speaker_embed
     hparams.train_with_pretrained_model = args.train_with_pretrained_model
     hparams.preserved = args.preserved
+    hparams.rebuild_cache = args.rebuild_cache
     return hparams
 
 